@@ -1,129 +1,415 @@
 import argparse
+import copy
 import os
-
-import anthropic
-from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request, session
+import secrets
+import time
+import zlib
+
+from flask import (
+    Blueprint,
+    Flask,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    session,
+)
 from flask_session import Session
-from openai import OpenAI
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from checkpoints import CheckpointStore
+from event_log import EventLog, format_event_report, read_events
+from http_cache import HttpCache
+from jobs import JobQueue, JobQueueFull, JobsPending
+from model_router import CALL_CONTEXTUAL, CALL_SCENE, ModelRouter
+from prompt_anatomy import PromptAnatomy, Section, format_report, join_sections
+from provider_limits import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PlayerRateLimiter,
+    ProviderBusy,
+    SlowDown,
+)
+from repetition import RepetitionGuard
+from response_cache import ResponseCache, state_fingerprint
+from scene_cache import SceneCache
+from session_gc import SessionSweeper
+from settings import load_config, setting
+from single_flight import SingleFlight, normalize_input
+from speculation import Speculator
+from story_state import SessionState, StateCodec, freeze
+from transcript import TranscriptStore
+from warmup import Warmup
 
-# Load environment variables from .env file
-load_dotenv()
+DEFAULT_SECRET_KEY = "your-secret-key-for-sessions-change-in-production"
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser(
-    description="Cliffhanger Stories - Interactive Adventure Game"
-)
-parser.add_argument(
-    "--provider",
-    type=str,
-    choices=["openai", "claude"],
-    default=None,
-    help='AI provider to use: "openai" (default) or "claude" (Anthropic)',
-)
-parser.add_argument(
-    "--reset", action="store_true", help="Clear session data and start fresh"
-)
-args, unknown = parser.parse_known_args()
 
-app = Flask(__name__)
-app.secret_key = "your-secret-key-for-sessions-change-in-production"
+# Flask's default static folder for this app
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 
-# Configure server-side session storage to handle large conversation histories
-app.config["SESSION_TYPE"] = "filesystem"
-app.config["SESSION_FILE_DIR"] = "./flask_session"
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_USE_SIGNER"] = True
-Session(app)
 
-# Handle session reset if --reset flag is provided
-if args.reset:
-    import shutil
+def session_file_dir(config):
+    return config.get("SESSION_FILE_DIR", "./flask_session")
 
-    session_dir = os.path.join(os.path.dirname(__file__), "flask_session")
-    if os.path.exists(session_dir):
-        shutil.rmtree(session_dir)
-        print("✓ Session data cleared - starting fresh")
-    else:
-        print("✓ No existing session data found - starting fresh")
 
-# AI Provider Configuration
-# Priority: command-line flag > environment variable > default (openai)
-if args.provider:
-    # Map 'claude' to 'anthropic' internally
-    AI_PROVIDER = "anthropic" if args.provider == "claude" else "openai"
-    print(f"AI provider set via command-line: {args.provider}")
-else:
-    AI_PROVIDER = os.getenv("AI_PROVIDER", "openai").lower()
-    if AI_PROVIDER not in ["openai", "anthropic"]:
-        print(
-            f"Warning: Invalid AI_PROVIDER '{AI_PROVIDER}' in .env, defaulting to 'openai'"
+class StoryRuntime:
+    """Services shared by every request handled by one app instance"""
+
+    def __init__(self, config):
+        self.config = config
+
+        # Route each call type to a provider and model
+        # Clients are created on first use, so OpenAI and Anthropic can both be live
+        self.model_router = ModelRouter.from_config(config)
+        for call_type, route in sorted(self.model_router.routes.items()):
+            print(
+                f"Using {route.provider} for {call_type} calls with model: {route.model}"
+            )
+
+        # Answers to common opening actions, shared across players while the scene is fresh
+        self.opening_cache = ResponseCache(
+            max_entries=setting(config, "OPENING_CACHE_SIZE", 512),
+            ttl=setting(config, "OPENING_CACHE_TTL", 86400.0),
+            variants=setting(config, "OPENING_CACHE_VARIANTS", 3),
+        )
+
+        # Replies to each scene's listed choices, generated while the player reads the scene
+        self.speculator = Speculator(
+            max_cost_per_hour=setting(config, "SPECULATION_MAX_COST_PER_HOUR", 1.0),
+            match_threshold=setting(config, "SPECULATION_MATCH_THRESHOLD", 0.75),
+        )
+
+        # Duplicate submissions (double-clicks) from the same session share one generation
+        self.turn_flights = SingleFlight(
+            linger=setting(config, "DUPLICATE_REQUEST_WINDOW", 2.0)
         )
-        AI_PROVIDER = "openai"
-
-# Initialize AI clients based on provider
-if AI_PROVIDER == "anthropic":
-    anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-    ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-opus-4-20250514")
-    print(f"Using Anthropic AI with model: {ANTHROPIC_MODEL}")
-else:
-    openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-2024-11-20")
-    print(f"Using OpenAI with model: {OPENAI_MODEL}")
+
+        # Turns each player may start in a burst and per minute after that
+        self.player_limits = PlayerRateLimiter(
+            burst=setting(config, "PLAYER_TURN_BURST", 5),
+            per_minute=setting(config, "PLAYER_TURNS_PER_MINUTE", 12),
+        )
+        # The same per client address, for clients that drop their session
+        # cookie to get a fresh bucket. Off unless ADDRESS_TURN_BURST is set,
+        # since behind a proxy every player has the proxy's address until
+        # TRUSTED_PROXIES is set too.
+        self.address_limits = PlayerRateLimiter(
+            burst=setting(config, "ADDRESS_TURN_BURST", 0),
+            per_minute=setting(config, "ADDRESS_TURNS_PER_MINUTE", 60),
+        )
+        if self.address_limits.enabled and not setting(config, "TRUSTED_PROXIES", 0):
+            print(
+                "Warning: ADDRESS_TURN_BURST is set without TRUSTED_PROXIES; behind a reverse proxy all players share one address limit"
+            )
+
+        # Scene expansions depend only on story data, so they are shared by all players
+        self.scene_cache = SceneCache(
+            config.get("SCENE_CACHE_DIR", "./scene_cache"),
+            variants=setting(config, "SCENE_CACHE_VARIANTS", 3),
+        )
+
+        # Prompt parts that depend only on the story definition (and scene),
+        # keyed by (title, name); turns then only build the dynamic sections
+        self._static_prompts = {}
+
+        steps = [
+            ("provider_connections", self.warm_provider_connections),
+            ("prompt_material", self.precompute_prompt_material),
+        ]
+        if setting(config, "WARMUP_PRELOAD_SCENES", True):
+            steps.append(("scene_cache", self.scene_cache.load_all))
+        self.warmup = Warmup(steps)
+
+        # Expires abandoned games from the filesystem session store
+        self.session_sweeper = SessionSweeper(
+            session_file_dir(config),
+            ttl=setting(config, "SESSION_TTL", 7 * 86400),
+            max_bytes=int(setting(config, "SESSION_STORE_MAX_MB", 0.0) * 1024 * 1024),
+            max_files=setting(config, "SESSION_STORE_MAX_FILES", 0),
+            interval=setting(config, "SESSION_SWEEP_INTERVAL", 3600),
+        )
+
+        # Story state at each scene boundary, so resume and replay need no provider call
+        self.checkpoints = CheckpointStore(
+            config.get("CHECKPOINT_DIR", "./checkpoints"),
+            per_player=setting(config, "CHECKPOINTS_PER_PLAYER", 10),
+            timeout=setting(config, "SESSION_TTL", 7 * 86400),
+            # Same pruning rule as the session store in create_app
+            threshold=0 if setting(config, "SESSION_SWEEP_INTERVAL", 3600) else 500,
+        )
+
+        # What each player has read, paged so the client can load it on scroll
+        self.transcripts = TranscriptStore(
+            config.get("TRANSCRIPT_DIR", "./transcripts"),
+            page_size=setting(config, "TRANSCRIPT_PAGE_SIZE", 20),
+            max_turns=setting(config, "TRANSCRIPT_MAX_TURNS", 500),
+            timeout=setting(config, "SESSION_TTL", 7 * 86400),
+            threshold=0 if setting(config, "SESSION_SWEEP_INTERVAL", 3600) else 500,
+        )
+
+        # Stores kept outside the session store expire on the same schedule,
+        # but don't count toward its size caps
+        self.store_sweepers = [
+            SessionSweeper(
+                store.directory,
+                ttl=setting(config, "SESSION_TTL", 7 * 86400),
+                interval=setting(config, "SESSION_SWEEP_INTERVAL", 3600),
+            )
+            for store in (self.checkpoints, self.transcripts)
+        ]
+
+        # Turn events for offline analysis, written off the request path
+        self.events = EventLog(
+            config.get("EVENT_LOG_DIR", "./event_log"),
+            capacity=setting(config, "EVENT_LOG_BUFFER", 10000),
+            batch_size=setting(config, "EVENT_LOG_BATCH", 500),
+            flush_interval=setting(config, "EVENT_LOG_FLUSH_SECONDS", 2.0),
+            segment_bytes=int(
+                setting(config, "EVENT_LOG_SEGMENT_MB", 16.0) * 1024 * 1024
+            ),
+            segment_seconds=setting(config, "EVENT_LOG_SEGMENT_SECONDS", 3600),
+            keep_segments=setting(config, "EVENT_LOG_KEEP_SEGMENTS", 0),
+        )
+
+        # Catches re-described passages after generation instead of in the prompt
+        self.repetition = RepetitionGuard(
+            ngram=setting(config, "REPETITION_NGRAM", 5),
+            threshold=setting(config, "REPETITION_THRESHOLD", 0.5),
+            sample=setting(config, "REPETITION_SAMPLE", 2),
+            action=config.get("REPETITION_ACTION", "measure"),
+        )
+        self.compact_rules = config.get("ANTI_REPETITION_RULES", "full") == "compact"
+
+        # Tokens per prompt section, to show where input spend goes
+        self.prompt_anatomy = PromptAnatomy(config.get("PROMPT_ANATOMY_LOG"))
+
+        # Compression, ETags and fingerprinted URLs for responses and assets
+        self.http_cache = HttpCache(
+            STATIC_DIR,
+            min_size=setting(config, "COMPRESS_MIN_BYTES", 500),
+            level=setting(config, "COMPRESS_LEVEL", 6),
+        )
+        self.static_max_age = setting(config, "STATIC_MAX_AGE", 365 * 86400)
+
+        # Long generations requested in job mode, run on a local worker pool
+        self.jobs = JobQueue(
+            workers=setting(config, "JOB_WORKERS", 4),
+            max_pending=setting(config, "JOB_MAX_PENDING", 64),
+            result_ttl=setting(config, "JOB_RESULT_TTL", 600),
+        )
+        # Jobs and their results live in this process, so only offer job mode
+        # where a player's polls come back here: a single process or --workers
+        self.async_turns = setting(config, "ASYNC_TURNS", True)
+        self.job_wait_timeout = setting(config, "JOB_WAIT_TIMEOUT", 15.0)
+
+    def start_background_tasks(self):
+        """Start warm-up and the session sweeper in the current process"""
+        self.warmup.start()
+        self.session_sweeper.start()
+        for sweeper in self.store_sweepers:
+            sweeper.start()
+
+    def static_prompt(self, story, name, build):
+        """Memoized prompt text or sections that depend only on the story definition
+
+        `name` may include the scene number for parts that change per scene.
+        """
+        key = (story["title"], name)
+        text = self._static_prompts.get(key)
+        if text is None:
+            text = self._static_prompts[key] = build()
+        return text
+
+    def warm_provider_connections(self):
+        return {
+            provider: self.model_router.warm(provider)
+            for provider in self.model_router.providers()
+        }
+
+    def precompute_prompt_material(self):
+        bot = AdventureBot(self)
+        for story in bot.story_arcs:
+            bot.current_story = story
+            bot.canonical_facts = story.get("canonical_facts", [])
+            bot.style_prompt()
+            bot.canonical_facts_prompt()
+            bot.scene_canonical_facts_prompt()
+            bot.scene_prompt_sections("")
+            for scene in range(len(story["scenes"]) + 1):
+                bot.current_scene = scene
+                bot.contextual_static_sections()
+        return len(self._static_prompts)
+
+
+def log_usage(result):
+    """Print token usage and estimated cost for a routed model call"""
+    print(
+        f"Usage: {result.input_tokens} input ({result.cached_tokens} cached), {result.output_tokens} output"
+    )
+    print(f"Cost: ${result.cost:.4f} (saved ${result.cache_savings:.4f} from caching)")
+
+
+def finish_text(content):
+    """Add an ellipsis to generated text that was cut off mid-sentence"""
+    if content and not content.rstrip().endswith((".", "!", "?", '"', "'", "...", ":")):
+        return content.rstrip() + "..."
+    return content
+
 
 # In-memory storage for stories (in production, use a database)
 stories = {}
 
+# Story definitions, built once and shared read-only by every bot
+STORY_ARCS = freeze(
+    [
+        {
+            "title": "The Algerian Eagle: A Nick Nolan Mystery",
+            "canonical_facts": [
+                "The Algerian Eagle is a valuable statue made of gold and has ruby eyes",
+                "The statue contains a hidden compartment that uncle only found recently",
+                "The uncle bought the statue in Tangiers in the 1920s",
+                "The uncle's name is Harold",
+                "The uncle had an identical twin brother named Charles",
+                "Vivian Sterling does not know about her uncle's twin",
+                "Charles is hiding out at his brother Harold's mansion and Thomas is aware of it but is afraid to tell",
+                "Vivian Sterling's uncle was killed for the statue",
+                "Nick Nolan has an antique paperweight on his desk that his grandfather gave him",
+                "Nick's paperweight was a reward from Vivian's uncle Harold after his grandfather James saved Harold's life in the WWI",
+                'Vivian Sterling always calls Nick "Nicholas" - never "Nick" and everyone else calls him "Nick"',
+                "The butler's name is Thomas",
+                "The uncle owned a mansion",
+                "Lefty Torrino is a scarred smuggler who wears a fedora",
+                "The story takes place in 1940s San Francisco",
+            ],
+            "intro": 'The lady, Vivian Sterling, sits across from you at your desk, seeming not to notice the unkempt pile of papers covered in coffee cup rings and ashtrays overflowing with Marlboro butts. The amber light from your desk lamp catches the worry lines around her eyes as she speaks in measured tones about her uncle\'s death. "Someone killed him for a statue called the Algerian Eagle, Nicholas," she says, her voice barely above a whisper. The way she uses your full name sends a chill down your spine - nobody calls you Nicholas. You\'re just Nick, the guy people come to when they need something no one else can give them: answers.\n\nShe seems a little distracted as she reaches into her pocketbook, but hesitates just a moment when her eyes land on the antique paperweight on your desk. You never explain things to people, but it slips out anyway. "My grandfather gave that to me." She nods slightly in acknowledgement and turns her attention back to retrieving a leather billfold that turns out to be a checkbook. "I\'ll pay whatever it costs to get answers, Nicholas," she says quietly. You tell her you don\'t take money until you have something to give her - something you\'ve never said to a potential client before.',
+            "scenes": [
+                "You decide to visit the uncle's mansion. The butler, a nervous wreck, claims he saw nothing. But you watch Vivian speak to him - she thanks him by name, asks how he's holding up, and lightly touches his arm when she sees his anxiety. \"It's alright, Thomas,\" she says gently. There's genuine warmth there. Then you notice fresh cigarette butts - expensive Turkish tobacco. You've never seen Vivian smoke, but someone was here recently. The plot thickens like fog rolling in from the bay. Do you ask Vivian about the cigarettes or investigate the butler's background?",
+                'Following a lead to the docks, you spot Vivian meeting with a scarred man in a fedora. She seems tense, unlike herself - you can see the strain in her posture as they speak quietly about "the bird" and you hear him growl "I got double-crossed." Suddenly, the scarred man pulls a gun! Do you intervene immediately, or stay hidden and follow whoever survives?',
+                'The scarred man is "Lefty" Torrino, a known smuggler. You tail him to a dusty import shop near the Barbary Coast where you overhear him talking on the telephone line: "The lady\'s getting too close. We gotta get rid of that detective." Your blood runs cold - they\'re talking about you! Do you call the cops, confront them alone, or set a trap?',
+                'You\'ve set up a meeting with Vivian at the old pier. She arrives with the Algerian Eagle, but so does Lefty with his gang. "I\'m sorry, Nicholas," Vivian says with genuine regret in her voice, "but some things are worth more than honor." Guns are drawn in the fog. After the confrontation ends, Vivian approaches you quietly. "That paperweight on your desk... my uncle gave it to your grandfather after your grandfather saved his life in the war. Uncle always said if I ever met a Nolan, I\'d know I could trust him with my life." You never thought of yourself as a noble character, but suddenly your posture straightens and you get a little emotional. It\'s not something obvious, just a shift in your mood, like a weight has been lifted and you know you\'ve carried on the legacy of being a worthy man. How do you respond to this revelation?',
+            ],
+        },
+        {
+            "title": "Perils of Penelope: A Silent Movie Melodrama",
+            "canonical_facts": [
+                "Penelope Pureheart is an orphaned heiress to the Pureheart Fortune",
+                "Snidely Whiplash is the villain with a magnificent mustache",
+                "Snidely holds a mortgage on the family farm",
+                "The story takes place in the early 1900s",
+                "Penelope has a dear sweet grandmother",
+            ],
+            "intro": "Our story opens on sweet, innocent Penelope Pureheart, orphaned heiress to the Pureheart Fortune. But lurking in the shadows with his magnificent mustache and dastardly grin is the villainous Snidely Whiplash! He's got a mortgage on the family farm and evil plans brewing. Will our heroine escape his clutches?",
+            "scenes": [
+                "Snidely has cornered Penelope in the old mill! \"Pay the mortgage or lose the farm, my pretty!\" he sneers, twirling his mustache. But wait - he's also holding a deed that would make him heir to everything if she can't pay! Penelope spots a rope hanging from the rafters. Does she try to swing to safety or attempt to grab the deed from his coat pocket?",
+                "Our heroine has escaped the mill, but Snidely gives chase on horseback! Penelope runs toward the railroad tracks where she knows the 3:15 train to Salvation City stops for water. But horror of horrors - Snidely has lassoed her! He's tying her to the very tracks as the distant whistle blows! Does she try to work the ropes loose with her hands or attempt to flag down the approaching train?",
+                "Penelope has freed one hand! The train is bearing down fast - she can see the engineer's horrified face and the piercing squeal of a 40-ton engine that's trying to stop in time to save her but won't be able to! But Snidely isn't done yet. He's placed a large boulder on the tracks ahead to derail the train! Our heroine must choose: finish freeing herself and jump clear, or stay tied and try to warn the train of the boulder ahead?",
+                "By a miracle, Penelope has warned the train and freed herself! But Snidely has one last card to play. He's kidnapped her dear sweet grandmother and taken her to his secret hideout in the abandoned mine! A note demands Penelope come alone with the deed to her fortune. Does she go alone as demanded, or try to rally the townspeople to help rescue Granny?",
+                "In the climactic showdown in the mine, Snidely has Granny tied up near a pile of dynamite! \"Sign over the deed or the old lady gets it!\" he cackles. But Penelope notices the fuse isn't lit and there's a pickaxe within reach. The question is: does she sign the deed to buy time, grab the pickaxe and fight, or try to untie Granny while Snidely gloats?",
+            ],
+        },
+    ]
+)
+
+
+# Common descriptive keywords to track
+DESCRIPTIVE_PATTERNS = (
+    "gray eyes",
+    "honey-colored hair",
+    "honey colored hair",
+    "lilac perfume",
+    "sapphire ring",
+    "amber light",
+    "desk lamp",
+    "coffee cup rings",
+    "coffee rings",
+    "ashtrays",
+    "tall for a woman",
+    "head shorter",
+    "elegant",
+    "refined",
+    "composed",
+    "fog",
+    "bay",
+    "docks",
+    "mansion",
+    "study",
+    "library",
+    "parlor",
+    "butler",
+    "Thomas",
+    "nervous",
+    "wreck",
+    "nervous wreck",
+    "leaning back",
+    "toying with",
+    "checkbook",
+    "pocketbook",
+    "Turkish tobacco",
+    "cigarette butts",
+    "Marlboro",
+    "office",
+    "filing cabinets",
+    "papers",
+    "scarred",
+    "fedora",
+    "lefty",
+    "torrino",
+)
+
+# Standing anti-repetition instructions for free-form turns. The compact
+# version relies on RepetitionGuard catching repeats after generation.
+ANTI_REPETITION_RULES = """CRITICAL ANTI-REPETITION RULES:
+11. NEVER re-describe settings, rooms, or locations that have already been described
+12. NEVER re-mention character physical appearances (eyes, hair, height, perfume, jewelry) once established
+13. NEVER re-describe objects, furniture, or atmospheric details already mentioned
+14. DO NOT repeat phrases like "gray eyes", "honey-colored hair", "lilac perfume", "sapphire ring"
+15. DO NOT re-describe the room ambiance, lighting, or general setting
+16. When a character speaks or acts, focus ONLY on: what they say/do NOW, new information revealed, plot advancement
+17. Assume setting and character appearances are already established - skip all physical descriptions
+18. If you must reference a character, use their name only - no descriptive modifiers
+19. Each response should contain ONLY: new dialogue, new actions, new discoveries, plot progression
+20. Think: "What's NEW in this moment?" - describe ONLY that
+
+"""
+
+COMPACT_ANTI_REPETITION_RULES = """ANTI-REPETITION:
+- Don't re-describe places, objects or characters the player has already read about; use names only
+- Describe only what is NEW in this moment: dialogue, actions, discoveries, plot progression
+
+"""
+
+# Every label extract_described_elements can record. Stored sessions refer to
+# labels by position, so only ever append to this list.
+DESCRIBED_ELEMENT_LABELS = DESCRIPTIVE_PATTERNS + (
+    "Vivian appearance",
+    "Nick appearance",
+    "Thomas description",
+    "Lefty description",
+    "office setting",
+    "mansion setting",
+    "docks setting",
+)
+STATE_CODEC = StateCodec(DESCRIBED_ELEMENT_LABELS)
+
+# Keys used by sessions saved before state was stored under "state"
+LEGACY_SESSION_KEYS = (
+    "current_story_index",
+    "current_scene",
+    "conversation_history",
+    "described_elements",
+    "story_facts",
+)
+
 
 class AdventureBot:
-    def __init__(self):
-        self.story_arcs = [
-            {
-                "title": "The Algerian Eagle: A Nick Nolan Mystery",
-                "canonical_facts": [
-                    "The Algerian Eagle is a valuable statue made of gold and has ruby eyes",
-                    "The statue contains a hidden compartment that uncle only found recently",
-                    "The uncle bought the statue in Tangiers in the 1920s",
-                    "The uncle's name is Harold",
-                    "The uncle had an identical twin brother named Charles",
-                    "Vivian Sterling does not know about her uncle's twin",
-                    "Charles is hiding out at his brother Harold's mansion and Thomas is aware of it but is afraid to tell",
-                    "Vivian Sterling's uncle was killed for the statue",
-                    "Nick Nolan has an antique paperweight on his desk that his grandfather gave him",
-                    "Nick's paperweight was a reward from Vivian's uncle Harold after his grandfather James saved Harold's life in the WWI",
-                    'Vivian Sterling always calls Nick "Nicholas" - never "Nick" and everyone else calls him "Nick"',
-                    "The butler's name is Thomas",
-                    "The uncle owned a mansion",
-                    "Lefty Torrino is a scarred smuggler who wears a fedora",
-                    "The story takes place in 1940s San Francisco",
-                ],
-                "intro": 'The lady, Vivian Sterling, sits across from you at your desk, seeming not to notice the unkempt pile of papers covered in coffee cup rings and ashtrays overflowing with Marlboro butts. The amber light from your desk lamp catches the worry lines around her eyes as she speaks in measured tones about her uncle\'s death. "Someone killed him for a statue called the Algerian Eagle, Nicholas," she says, her voice barely above a whisper. The way she uses your full name sends a chill down your spine - nobody calls you Nicholas. You\'re just Nick, the guy people come to when they need something no one else can give them: answers.\n\nShe seems a little distracted as she reaches into her pocketbook, but hesitates just a moment when her eyes land on the antique paperweight on your desk. You never explain things to people, but it slips out anyway. "My grandfather gave that to me." She nods slightly in acknowledgement and turns her attention back to retrieving a leather billfold that turns out to be a checkbook. "I\'ll pay whatever it costs to get answers, Nicholas," she says quietly. You tell her you don\'t take money until you have something to give her - something you\'ve never said to a potential client before.',
-                "scenes": [
-                    "You decide to visit the uncle's mansion. The butler, a nervous wreck, claims he saw nothing. But you watch Vivian speak to him - she thanks him by name, asks how he's holding up, and lightly touches his arm when she sees his anxiety. \"It's alright, Thomas,\" she says gently. There's genuine warmth there. Then you notice fresh cigarette butts - expensive Turkish tobacco. You've never seen Vivian smoke, but someone was here recently. The plot thickens like fog rolling in from the bay. Do you ask Vivian about the cigarettes or investigate the butler's background?",
-                    'Following a lead to the docks, you spot Vivian meeting with a scarred man in a fedora. She seems tense, unlike herself - you can see the strain in her posture as they speak quietly about "the bird" and you hear him growl "I got double-crossed." Suddenly, the scarred man pulls a gun! Do you intervene immediately, or stay hidden and follow whoever survives?',
-                    'The scarred man is "Lefty" Torrino, a known smuggler. You tail him to a dusty import shop near the Barbary Coast where you overhear him talking on the telephone line: "The lady\'s getting too close. We gotta get rid of that detective." Your blood runs cold - they\'re talking about you! Do you call the cops, confront them alone, or set a trap?',
-                    'You\'ve set up a meeting with Vivian at the old pier. She arrives with the Algerian Eagle, but so does Lefty with his gang. "I\'m sorry, Nicholas," Vivian says with genuine regret in her voice, "but some things are worth more than honor." Guns are drawn in the fog. After the confrontation ends, Vivian approaches you quietly. "That paperweight on your desk... my uncle gave it to your grandfather after your grandfather saved his life in the war. Uncle always said if I ever met a Nolan, I\'d know I could trust him with my life." You never thought of yourself as a noble character, but suddenly your posture straightens and you get a little emotional. It\'s not something obvious, just a shift in your mood, like a weight has been lifted and you know you\'ve carried on the legacy of being a worthy man. How do you respond to this revelation?',
-                ],
-            },
-            {
-                "title": "Perils of Penelope: A Silent Movie Melodrama",
-                "canonical_facts": [
-                    "Penelope Pureheart is an orphaned heiress to the Pureheart Fortune",
-                    "Snidely Whiplash is the villain with a magnificent mustache",
-                    "Snidely holds a mortgage on the family farm",
-                    "The story takes place in the early 1900s",
-                    "Penelope has a dear sweet grandmother",
-                ],
-                "intro": "Our story opens on sweet, innocent Penelope Pureheart, orphaned heiress to the Pureheart Fortune. But lurking in the shadows with his magnificent mustache and dastardly grin is the villainous Snidely Whiplash! He's got a mortgage on the family farm and evil plans brewing. Will our heroine escape his clutches?",
-                "scenes": [
-                    "Snidely has cornered Penelope in the old mill! \"Pay the mortgage or lose the farm, my pretty!\" he sneers, twirling his mustache. But wait - he's also holding a deed that would make him heir to everything if she can't pay! Penelope spots a rope hanging from the rafters. Does she try to swing to safety or attempt to grab the deed from his coat pocket?",
-                    "Our heroine has escaped the mill, but Snidely gives chase on horseback! Penelope runs toward the railroad tracks where she knows the 3:15 train to Salvation City stops for water. But horror of horrors - Snidely has lassoed her! He's tying her to the very tracks as the distant whistle blows! Does she try to work the ropes loose with her hands or attempt to flag down the approaching train?",
-                    "Penelope has freed one hand! The train is bearing down fast - she can see the engineer's horrified face and the piercing squeal of a 40-ton engine that's trying to stop in time to save her but won't be able to! But Snidely isn't done yet. He's placed a large boulder on the tracks ahead to derail the train! Our heroine must choose: finish freeing herself and jump clear, or stay tied and try to warn the train of the boulder ahead?",
-                    "By a miracle, Penelope has warned the train and freed herself! But Snidely has one last card to play. He's kidnapped her dear sweet grandmother and taken her to his secret hideout in the abandoned mine! A note demands Penelope come alone with the deed to her fortune. Does she go alone as demanded, or try to rally the townspeople to help rescue Granny?",
-                    "In the climactic showdown in the mine, Snidely has Granny tied up near a pile of dynamite! \"Sign over the deed or the old lady gets it!\" he cackles. But Penelope notices the fuse isn't lit and there's a pickaxe within reach. The question is: does she sign the deed to buy time, grab the pickaxe and fight, or try to untie Granny while Snidely gloats?",
-                ],
-            },
-        ]
+    def __init__(self, runtime, session_data=None, sid=None):
+        self.runtime = runtime
+        # The player's session data: the Flask session, or a stored session's
+        # data when a background job runs the turn outside any request
+        self.session = session if session_data is None else session_data
+        self._sid = sid
+        # Shared, read-only story definitions
+        self.story_arcs = STORY_ARCS
         self.current_scene = 0
         self.current_story = None
         self.conversation_history = []  # Track what has happened in current scene
@@ -134,17 +420,76 @@ class AdventureBot:
             []
         )  # Track established facts and revelations that must remain consistent
         self.canonical_facts = []  # Immutable facts from the story definition
+        self.scene_shingles = set()  # Shingles of the scene text the player has read
+        # Provider usage of the turn being played, and where its text came from
+        self.turn_usage = {
+            "calls": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cached_tokens": 0,
+            "cost": 0.0,
+        }
+        self.turn_source = None
+        self.transcript_position = None  # (transcript id, index) of the last entry
+
+    @property
+    def session_id(self):
+        return self._sid or session.sid
+
+    def track_usage(self, result):
+        """Add a provider call's usage to this turn's totals"""
+        self.turn_usage["calls"] += 1
+        self.turn_usage["input_tokens"] += result.input_tokens
+        self.turn_usage["output_tokens"] += result.output_tokens
+        self.turn_usage["cached_tokens"] += result.cached_tokens
+        self.turn_usage["cost"] += result.cost
+
+    def turn_event(self, kind, value, response, status, seconds):
+        """Event log entry for a finished turn"""
+        message = (response or {}).get("message", "")
+        text = value if isinstance(value, str) else None
+        return {
+            "ts": round(time.time(), 3),
+            "type": kind,
+            "status": status,
+            "player": self.session.get("player"),
+            "story": (
+                self.story_arcs.index(self.current_story)
+                if self.current_story
+                else None
+            ),
+            "scene": self.current_scene,
+            "input": text[:500] if text else None,
+            "input_chars": len(text) if text else 0,
+            "response_chars": len(message),
+            "history": len(self.conversation_history),
+            "source": self.turn_source,
+            "seconds": round(seconds, 4),
+            **self.turn_usage,
+            "cost": round(self.turn_usage["cost"], 6),
+        }
 
     def load_from_session(self):
-        """Load bot state from Flask session"""
-        if "current_story_index" in session:
-            story_index = session["current_story_index"]
-            self.current_story = self.story_arcs[story_index]
-            self.current_scene = session.get("current_scene", 0)
-            self.conversation_history = session.get("conversation_history", [])
-            self.described_elements = set(session.get("described_elements", []))
-            self.story_facts = session.get("story_facts", [])
-            self.canonical_facts = self.current_story.get("canonical_facts", [])
+        """Load bot state from the player's session"""
+        if "state" in self.session:
+            state = STATE_CODEC.decode(self.session["state"])
+        elif "current_story_index" in self.session:
+            # Sessions saved before state was stored compactly
+            state = SessionState(
+                self.session["current_story_index"],
+                self.session.get("current_scene", 0),
+                [
+                    (item["user"], item["response"])
+                    for item in self.session.get("conversation_history", [])
+                ],
+                STATE_CODEC.element_ids(self.session.get("described_elements", [])),
+                self.session.get("story_facts", []),
+            )
+        else:
+            state = None
+
+        if state is not None:
+            self.apply_state(state)
             print(
                 f"Loaded from session: story={self.current_story['title']}, scene={self.current_scene}, history items={len(self.conversation_history)}"
             )
@@ -160,18 +505,39 @@ class AdventureBot:
             self.described_elements = set()
             self.story_facts = []
 
+    def apply_state(self, state):
+        """Take the story state from a SessionState"""
+        self.current_story = self.story_arcs[state.story_index]
+        self.current_scene = state.scene
+        self.conversation_history = [
+            {"user": user, "response": response} for user, response in state.history
+        ]
+        self.described_elements = STATE_CODEC.element_labels(state.elements)
+        self.story_facts = state.facts
+        self.scene_shingles = set(state.seen)
+        self.canonical_facts = self.current_story.get("canonical_facts", [])
+
+    def session_state(self):
+        """The bot's story state as a compact SessionState"""
+        return SessionState(
+            self.story_arcs.index(self.current_story),
+            self.current_scene,
+            [(item["user"], item["response"]) for item in self.conversation_history],
+            STATE_CODEC.element_ids(self.described_elements),
+            self.story_facts,
+            self.scene_shingles,
+        )
+
     def save_to_session(self):
-        """Save bot state to Flask session"""
+        """Save bot state to the player's session"""
+        for key in LEGACY_SESSION_KEYS:
+            self.session.pop(key, None)
         if self.current_story:
-            story_index = self.story_arcs.index(self.current_story)
-            session["current_story_index"] = story_index
-            session["current_scene"] = self.current_scene
-            session["conversation_history"] = self.conversation_history
-            session["described_elements"] = list(self.described_elements)
-            session["story_facts"] = self.story_facts
+            state = self.session_state()
             # canonical_facts don't need to be saved - they're loaded from story definition
+            self.session["state"] = STATE_CODEC.encode(state)
             print(
-                f"Saved to session: story_index={story_index}, scene={self.current_scene}, history items={len(self.conversation_history)}"
+                f"Saved to session: story_index={state.story_index}, scene={self.current_scene}, history items={len(self.conversation_history)}"
             )
             if self.conversation_history:
                 print(
@@ -180,11 +546,7 @@ class AdventureBot:
             else:
                 print("DEBUG: Saving empty conversation history")
         else:
-            session.pop("current_story_index", None)
-            session.pop("current_scene", None)
-            session.pop("conversation_history", None)
-            session.pop("described_elements", None)
-            session.pop("story_facts", None)
+            self.session.pop("state", None)
             print("Cleared session data")
 
     def start_story(self, story_index):
@@ -201,15 +563,14 @@ class AdventureBot:
         # Extract elements from intro text to prevent repetition
         intro_text = self.current_story["intro"]
         self.extract_described_elements(intro_text, 0)
+        self.scene_shingles = self.runtime.repetition.scene_fingerprint(intro_text)
 
         print(
             f"Story set to: {self.current_story['title']}, scene: {self.current_scene}"
         )
         self.save_to_session()
-        return {
-            "message": intro_text + "\n\nWhat do you want to do next?",
-            "image": f"story{story_index+1}_1.jpg",
-        }
+        response = self.record(self.scene_response(intro_text), restart=True)
+        return self.add_checkpoint(response, intro_text)
 
     def next_scene(self, choice=None):
         print(
@@ -238,17 +599,118 @@ class AdventureBot:
         generated_content = self.generate_scene_content(
             scene_outline, self.current_story
         )
+        self.scene_shingles = self.runtime.repetition.scene_fingerprint(
+            generated_content
+        )
 
         # Filter conversation history and save
         self.filter_history_for_scene_change()
         self.save_to_session()
+        response = self.record(self.scene_response(generated_content))
+
+        self.start_choice_speculation(scene_outline)
+
+        return self.add_checkpoint(response, generated_content)
 
+    def scene_response(self, scene_text, checkpoint=None):
+        """Response for arriving at a scene, by playing, resuming or replaying"""
+        story_index = self.story_arcs.index(self.current_story)
         response = {
-            "message": generated_content + "\n\nWhat do you want to do next?",
-            "image": f"story{self.story_arcs.index(self.current_story)+1}_{self.current_scene}.jpg",
+            "message": scene_text + "\n\nWhat do you want to do next?",
+            "story_id": story_index,
+            # The intro shares the first scene's image
+            "image": self.runtime.http_cache.asset_url(
+                f"story{story_index+1}_{max(1, self.current_scene)}.jpg"
+            ),
         }
+        if checkpoint:
+            response["checkpoint"] = checkpoint["id"]
+        return response
+
+    def record(self, response, user_input=None, restart=False, at=None):
+        """Add a turn's message to the player's transcript; returns the response
+
+        `at` is a transcript position to rewind to first, from a checkpoint.
+        """
+        store = self.runtime.transcripts
+        if store.enabled:
+            try:
+                self.transcript_position = store.append(
+                    self.player_id(),
+                    self.story_arcs.index(self.current_story),
+                    self.current_scene,
+                    response["message"],
+                    user_input,
+                    restart,
+                    at,
+                )
+                response["index"] = self.transcript_position[1]
+            except Exception as e:
+                print(f"Warning: Could not record transcript: {e}")
         return response
 
+    def player_id(self):
+        """Stable id for the player's checkpoints, kept when they resume elsewhere"""
+        if "player" not in self.session:
+            self.session["player"] = secrets.token_urlsafe(12)
+        return self.session["player"]
+
+    def add_checkpoint(self, response, scene_text):
+        """Checkpoint the scene just recorded and add its id to the response"""
+        checkpoint = self.save_checkpoint(scene_text)
+        if checkpoint:
+            response["checkpoint"] = checkpoint["id"]
+        return response
+
+    def save_checkpoint(self, scene_text):
+        """Snapshot the state at a scene boundary; returns the index entry"""
+        store = self.runtime.checkpoints
+        if not store.enabled:
+            return None
+        try:
+            return store.save(
+                self.player_id(),
+                self.story_arcs.index(self.current_story),
+                self.current_scene,
+                STATE_CODEC.encode(self.session_state()),
+                scene_text,
+                # Where the scene's transcript entry is, to rewind to on resume
+                self.transcript_position,
+            )
+        except Exception as e:
+            # Playing on matters more than being able to rewind
+            print(f"Warning: Could not save checkpoint: {e}")
+            return None
+
+    def restore_checkpoint(self, checkpoint_id):
+        """Return to a checkpoint's scene; None if the checkpoint is gone"""
+        loaded = self.runtime.checkpoints.load(checkpoint_id)
+        if loaded is None:
+            return None
+        player, entry, state, scene_text = loaded
+        # Holding the id is enough to resume, in this session or a new one
+        self.session["player"] = player
+        self.apply_state(STATE_CODEC.decode(state))
+        print(
+            f"Restored checkpoint {checkpoint_id}: story={self.current_story['title']}, scene={self.current_scene}"
+        )
+        self.save_to_session()
+        self.runtime.speculator.discard(self.session_id)
+        return self.record(
+            self.scene_response(scene_text, entry), at=entry.get("transcript")
+        )
+
+    def replay_scene(self, scene):
+        """Return to the start of a scene of the current story, if checkpointed"""
+        if not self.current_story or "player" not in self.session:
+            return None
+        entry = self.runtime.checkpoints.find(
+            self.session["player"], self.story_arcs.index(self.current_story), scene
+        )
+        if entry is None:
+            return None
+        return self.restore_checkpoint(entry["id"])
+
     def filter_history_for_scene_change(self):
         """Keep important story elements, remove location-specific actions"""
         if not self.conversation_history:
@@ -433,53 +895,9 @@ class AdventureBot:
 
     def extract_described_elements(self, content, scene_number):
         """Extract and track elements that have been described to prevent repetition"""
-        # Common descriptive keywords to track
-        descriptive_patterns = [
-            "gray eyes",
-            "honey-colored hair",
-            "honey colored hair",
-            "lilac perfume",
-            "sapphire ring",
-            "amber light",
-            "desk lamp",
-            "coffee cup rings",
-            "coffee rings",
-            "ashtrays",
-            "tall for a woman",
-            "head shorter",
-            "elegant",
-            "refined",
-            "composed",
-            "fog",
-            "bay",
-            "docks",
-            "mansion",
-            "study",
-            "library",
-            "parlor",
-            "butler",
-            "Thomas",
-            "nervous",
-            "wreck",
-            "nervous wreck",
-            "leaning back",
-            "toying with",
-            "checkbook",
-            "pocketbook",
-            "Turkish tobacco",
-            "cigarette butts",
-            "Marlboro",
-            "office",
-            "filing cabinets",
-            "papers",
-            "scarred",
-            "fedora",
-            "lefty",
-            "torrino",
-        ]
 
         content_lower = content.lower()
-        for pattern in descriptive_patterns:
+        for pattern in DESCRIPTIVE_PATTERNS:
             if pattern.lower() in content_lower:
                 self.described_elements.add(pattern)
                 print(f"DEBUG: Tracked described element: '{pattern}'")
@@ -553,18 +971,24 @@ class AdventureBot:
 
     def extract_choices_from_outline(self, scene_outline):
         """Extract choice options from the scene outline"""
+        import re
+
         # Look for the question and choices at the end of the outline
-        if "Do you " in scene_outline:
+        questions = re.split(r"\b(?:Do you|Does she|does she) ", scene_outline)
+        if len(questions) > 1:
             # Find the part after "Do you" which contains the choices
-            question_part = scene_outline.split("Do you ")[-1]
+            question_part = questions[-1]
 
-            # Split on " or " to get individual choices
+            # Split on " or " (and list commas) to get individual choices
             if " or " in question_part:
                 choices_text = question_part.split("?")[
                     0
                 ]  # Remove anything after the question mark
-                choices = [choice.strip() for choice in choices_text.split(" or ")]
-                return choices
+                choices = [
+                    choice.strip(" ,")
+                    for choice in re.split(r",?\s+or\s+|,\s+", choices_text)
+                ]
+                return [choice for choice in choices if choice]
 
         # Fallback to generic continue option
         return ["Continue..."]
@@ -608,72 +1032,216 @@ class AdventureBot:
         # Check if we've reached the end of predefined scenes
         if self.current_scene >= len(self.current_story["scenes"]):
             # Continue with open-ended adventure
-            return {"message": response_content + "\n\nWhat do you want to do next?"}
+            return self.record(
+                {"message": response_content + "\n\nWhat do you want to do next?"},
+                user_input,
+            )
 
-        return {"message": response_content + "\n\nWhat do you want to do next?"}
+        return self.record(
+            {"message": response_content + "\n\nWhat do you want to do next?"},
+            user_input,
+        )
 
-    def generate_contextual_response(self, user_input):
-        """Generate a contextual response to user input using AI"""
-        try:
-            style_prompt = self.get_story_style_prompt(self.current_story["title"])
-
-            # Get current scene context and location
-            current_scene_outline = ""
-            scene_location = ""
-            scene_characters = ""
-
-            print(f"DEBUG: Generating response for scene {self.current_scene}")
-            print(f"DEBUG: User input: '{user_input[:50]}...'")
-
-            if self.current_scene == 0:
-                # Intro scene - Nick's office
-                current_scene_outline = self.current_story["intro"]
-                scene_location = "Nick Nolan's detective office in 1940s San Francisco"
-                scene_characters = "Nick Nolan (you) and Vivian Sterling"
-                print(f"DEBUG: Scene 0 - Office setting")
-            elif self.current_scene < len(self.current_story["scenes"]):
-                current_scene_outline = self.current_story["scenes"][
-                    self.current_scene - 1
-                ]
-                # Determine location based on scene number
-                if self.current_scene == 1:
-                    scene_location = "The uncle's mansion - elegant but somber"
-                    scene_characters = (
-                        "Nick Nolan (you), Vivian Sterling, and Thomas the butler"
-                    )
-                    print(f"DEBUG: Scene 1 - Mansion setting")
-                elif self.current_scene == 2:
-                    scene_location = "The foggy docks near San Francisco Bay"
-                    scene_characters = (
-                        "Nick Nolan (you), Vivian Sterling, and Lefty Torrino"
-                    )
-                    print(f"DEBUG: Scene 2 - Docks setting")
-                elif self.current_scene == 3:
-                    scene_location = "Dusty import shop near the Barbary Coast"
-                    scene_characters = "Nick Nolan (you) and Lefty Torrino"
-                    print(f"DEBUG: Scene 3 - Import shop setting")
-                else:
-                    scene_location = "Various locations in 1940s San Francisco"
-                    scene_characters = "Nick Nolan (you) and other characters"
+    def style_prompt(self):
+        return self.runtime.static_prompt(
+            self.current_story,
+            "style",
+            lambda: self.get_story_style_prompt(self.current_story["title"]),
+        )
+
+    def canonical_facts_prompt(self):
+        """Numbered canonical facts block for free-form turns"""
+        return self.runtime.static_prompt(
+            self.current_story, "canonical_facts", self._build_canonical_facts_prompt
+        )
+
+    def _build_canonical_facts_prompt(self):
+        # Build list of canonical facts (immutable from story definition)
+        canonical_facts_context = ""
+        if self.canonical_facts:
+            canonical_facts_context = """⚠️ CANONICAL STORY FACTS - ABSOLUTELY IMMUTABLE (NEVER CHANGE THESE):
+"""
+            for i, fact in enumerate(self.canonical_facts, 1):
+                canonical_facts_context += f"{i}. {fact}\n"
+            canonical_facts_context += """
+🔒 LOCKED: These facts are PERMANENT and UNCHANGEABLE. They define the core story elements.
+- Character names NEVER change (Thomas is always Thomas, Vivian is always Vivian)
+- The Algerian Eagle is ALWAYS the statue's name - never "Maltese Falcon" or any other name
+- Vivian's uncle was killed - this NEVER changes
+- The paperweight connection NEVER changes
+- ALL canonical facts must be referenced EXACTLY as written above
+
+"""
+        return canonical_facts_context
+
+    def build_contextual_prompt(self, user_input):
+        """Build the system and user messages for a free-form turn"""
+        system_sections, user_sections = self.contextual_prompt_sections(user_input)
+        return join_sections(system_sections), join_sections(user_sections)
 
-            system_message = f"""You are an interactive storyteller for a text adventure game.
+    def contextual_prompt_sections(self, user_input):
+        """The free-form turn prompt as named system and user message sections"""
+        print(f"DEBUG: Generating response for scene {self.current_scene}")
+        print(f"DEBUG: User input: '{user_input[:50]}...'")
 
-{style_prompt}
+        static = self.contextual_static_sections()
 
-CURRENT STORY CONTEXT:
+        # Build conversation history context
+        history_context = ""
+        if self.conversation_history:
+            print(
+                f"DEBUG: Building history context with {len(self.conversation_history)} interactions"
+            )
+            print(
+                f"DEBUG: Conversation history items: {[h['user'][:50] for h in self.conversation_history]}"
+            )
+            history_context = """📜 CONVERSATION HISTORY - EVERYTHING THAT HAS HAPPENED IN THIS SCENE:
+(Characters REMEMBER all of this. You MUST maintain continuity with these exchanges.)
+
+"""
+            exchanges = []
+            for i, interaction in enumerate(self.conversation_history, 1):
+                # Include FULL conversation, not truncated
+                exchanges.append(
+                    f"Exchange {i}:\n"
+                    f"Player asked/did: {interaction['user']}\n"
+                    f"You responded: {interaction['response']}\n"
+                    "---\n\n"
+                )
+                print(
+                    f"DEBUG: Added exchange {i} to context - User: '{interaction['user'][:40]}...'"
+                )
+            history_context += "".join(exchanges)
+            history_context += """⚠️ CRITICAL CONTINUITY RULES:
+- Characters REMEMBER everything from these exchanges
+- QUOTED DIALOGUE = CHARACTER SPEECH: Anything in quotes is what a character said out loud
+- If a character mentioned someone (like Dr. Whitmore), they KNOW about them in future responses
+- If a character said something in quotes, they SAID IT - track their knowledge accordingly
+- If information was revealed, it STAYS revealed - don't contradict it
+- Build on what was said, don't reset or forget
+- Maintain consistent character knowledge and awareness
+- Example: If Vivian said "I don't know any Dr. Whitmore" then she DOESN'T know Dr. Whitmore
+
+"""
+        else:
+            print("DEBUG: No conversation history available for context")
+
+        # Build list of already described elements
+        already_described = ""
+        if self.described_elements:
+            already_described = f"""🚫 ALREADY DESCRIBED IN THIS SCENE - ABSOLUTELY DO NOT MENTION AGAIN:
+{', '.join(sorted(self.described_elements))}
+
+⚠️ CRITICAL: You MUST NOT re-describe any of these elements. 
+- If "Thomas description" is listed, DO NOT describe Thomas as nervous, a wreck, anxious, etc.
+- If "Vivian appearance" is listed, DO NOT mention her eyes, hair, perfume, or jewelry
+- If character descriptions are listed, refer to them by NAME ONLY with NO descriptive words
+- Focus ONLY on what is NEW in this moment - new actions, new dialogue, new discoveries
+- Example: Write "Thomas speaks" NOT "The nervous butler speaks"
+"""
+
+        # Build list of established story facts that must remain consistent
+        story_facts_context = ""
+        if self.story_facts:
+            story_facts_context = """ESTABLISHED FACTS FROM GAMEPLAY - THESE MUST REMAIN CONSISTENT:
+"""
+            story_facts_context += "".join(
+                f"{i}. {fact}\n" for i, fact in enumerate(self.story_facts, 1)
+            )
+            story_facts_context += """
+CRITICAL: These facts emerged during gameplay and are LOCKED IN. You CANNOT contradict them. If a character said they saw something, they cannot later deny it. If evidence was discovered, it stays discovered. Build on these facts, don't reverse them.
+
+"""
+
+        user_sections = [
+            Section("input", f"USER INPUT: {user_input}\n\n", False),
+            static["location lock"],
+            Section("described elements", already_described + "\n\n", False),
+            static["canonical facts"],
+            Section("story facts", story_facts_context + "\n\n", False),
+            Section("history", history_context, False),
+            static["closing"],
+        ]
+        return list(static["system"]), user_sections
+
+    def contextual_static_sections(self):
+        """Sections of the free-form turn prompt that only change with the scene"""
+        return self.runtime.static_prompt(
+            self.current_story,
+            ("contextual", self.current_scene),
+            self._build_contextual_static_sections,
+        )
+
+    def _build_contextual_static_sections(self):
+        style_prompt = self.style_prompt()
+
+        # Get current scene context and location
+        current_scene_outline = ""
+        scene_location = ""
+        scene_characters = ""
+
+        if self.current_scene == 0:
+            # Intro scene - Nick's office
+            current_scene_outline = self.current_story["intro"]
+            scene_location = "Nick Nolan's detective office in 1940s San Francisco"
+            scene_characters = "Nick Nolan (you) and Vivian Sterling"
+            print(f"DEBUG: Scene 0 - Office setting")
+        elif self.current_scene < len(self.current_story["scenes"]):
+            current_scene_outline = self.current_story["scenes"][self.current_scene - 1]
+            # Determine location based on scene number
+            if self.current_scene == 1:
+                scene_location = "The uncle's mansion - elegant but somber"
+                scene_characters = (
+                    "Nick Nolan (you), Vivian Sterling, and Thomas the butler"
+                )
+                print(f"DEBUG: Scene 1 - Mansion setting")
+            elif self.current_scene == 2:
+                scene_location = "The foggy docks near San Francisco Bay"
+                scene_characters = (
+                    "Nick Nolan (you), Vivian Sterling, and Lefty Torrino"
+                )
+                print(f"DEBUG: Scene 2 - Docks setting")
+            elif self.current_scene == 3:
+                scene_location = "Dusty import shop near the Barbary Coast"
+                scene_characters = "Nick Nolan (you) and Lefty Torrino"
+                print(f"DEBUG: Scene 3 - Import shop setting")
+            else:
+                scene_location = "Various locations in 1940s San Francisco"
+                scene_characters = "Nick Nolan (you) and other characters"
+
+        system_sections = [
+            Section(
+                "preamble",
+                "You are an interactive storyteller for a text adventure game.\n\n",
+                True,
+            ),
+            Section("style", style_prompt + "\n\n", True),
+            Section(
+                "scene context",
+                f"""CURRENT STORY CONTEXT:
 Title: {self.current_story['title']}
 Current scene: {current_scene_outline}
 Scene location: {scene_location}
 Characters present: {scene_characters}
 
-SCENE LOCK - YOU ARE CURRENTLY IN SCENE {self.current_scene}:
+""",
+                True,
+            ),
+            Section(
+                "scene lock",
+                f"""SCENE LOCK - YOU ARE CURRENTLY IN SCENE {self.current_scene}:
 - You MUST stay in this scene location until explicitly told to advance
 - You CANNOT jump to other scenes (office, mansion, docks, shop) 
 - All exploration happens WITHIN the current scene location
 - DO NOT generate content from other scene numbers
 Scene Description: {current_scene_outline}
 
-INTERACTIVE INSTRUCTIONS:
+""",
+                True,
+            ),
+            Section(
+                "rules",
+                """INTERACTIVE INSTRUCTIONS:
 1. This is a pure text adventure - respond to ANY user action or question
 2. The user can explore, investigate, talk to characters, or try creative actions
 3. Respond in character and maintain the story's atmosphere
@@ -693,31 +1261,28 @@ DIALOGUE TRACKING (CRITICAL):
 15. You can write dialogue without speech tags: She shifts. "I don't know him." Her voice wavers.
 16. But ALWAYS use quotes for actual speech so we can track what characters know and claim
 
-CRITICAL ANTI-REPETITION RULES:
-11. NEVER re-describe settings, rooms, or locations that have already been described
-12. NEVER re-mention character physical appearances (eyes, hair, height, perfume, jewelry) once established
-13. NEVER re-describe objects, furniture, or atmospheric details already mentioned
-14. DO NOT repeat phrases like "gray eyes", "honey-colored hair", "lilac perfume", "sapphire ring"
-15. DO NOT re-describe the room ambiance, lighting, or general setting
-16. When a character speaks or acts, focus ONLY on: what they say/do NOW, new information revealed, plot advancement
-17. Assume setting and character appearances are already established - skip all physical descriptions
-18. If you must reference a character, use their name only - no descriptive modifiers
-19. Each response should contain ONLY: new dialogue, new actions, new discoveries, plot progression
-20. Think: "What's NEW in this moment?" - describe ONLY that
-
-LOCATION COMPLIANCE IS MANDATORY - You MUST stay in the specified location and NEVER mix elements from other scenes"""
+""",
+                True,
+            ),
+            Section("anti-repetition rules", self.anti_repetition_rules(), True),
+            Section(
+                "location compliance",
+                """LOCATION COMPLIANCE IS MANDATORY - You MUST stay in the specified location and NEVER mix elements from other scenes""",
+                True,
+            ),
+        ]
 
-            # Create location-specific context
-            location_context = ""
-            if self.current_scene == 0:
-                location_context = """LOCATION: Nick's detective office in San Francisco (SCENE 0)
+        # Create location-specific context
+        location_context = ""
+        if self.current_scene == 0:
+            location_context = """LOCATION: Nick's detective office in San Francisco (SCENE 0)
 - SETTING: Indoor office with desk, chairs, filing cabinets, desk lamp
 - ATMOSPHERE: Gritty, urban, cigarette smoke, coffee stains
 - CHARACTERS PRESENT: Only Nick and Vivian
 - ABSOLUTELY NO: Fog, bay sounds, docks, water, pylons, foghorns, mansion elements, butlers, Thomas
 - YOU ARE IN AN OFFICE - NOT at mansion, not at docks, not anywhere else"""
-            elif self.current_scene == 1:
-                location_context = """MANSION EXPLORATION LOCK (SCENE 1 ONLY):
+        elif self.current_scene == 1:
+            location_context = """MANSION EXPLORATION LOCK (SCENE 1 ONLY):
 - YOU ARE INSIDE THE UNCLE'S MANSION - A WEALTHY INDOOR HOME
 - MANSION ROOMS: Library, parlor, dining room, study, east wing, west wing, servants' quarters
 - MANSION OBJECTS: Ashtrays with cigarettes, bookshelves, paintings, furniture, carpets, chandeliers
@@ -726,139 +1291,205 @@ LOCATION COMPLIANCE IS MANDATORY - You MUST stay in the specified location and N
 - ZERO DOCKS CONTENT: No fog, no bay, no ships, no pylons, no maritime anything
 - IF USER EXPLORES MANSION, RESPONSE STAYS IN MANSION - DO NOT JUMP TO DOCKS SCENE
 - MANSION ONLY - MANSION ONLY - MANSION ONLY"""
-            elif self.current_scene == 2:
-                location_context = """LOCATION: Foggy docks by San Francisco Bay (OUTDOOR)
+        elif self.current_scene == 2:
+            location_context = """LOCATION: Foggy docks by San Francisco Bay (OUTDOOR)
 - SETTING: Waterfront with fog, bay sounds, pylons, piers, ships
 - ATMOSPHERE: Misty, maritime, salt air, water lapping, foghorns
 - NO: Mansion elements, office furniture, indoor settings"""
-            elif self.current_scene == 3:
-                location_context = """LOCATION: Dusty import shop near Barbary Coast (INDOOR)
+        elif self.current_scene == 3:
+            location_context = """LOCATION: Dusty import shop near Barbary Coast (INDOOR)
 - SETTING: Commercial shop with shelves, imported goods, dusty atmosphere
 - ATMOSPHERE: Commercial, cramped, merchandise displays
 - NO: Fog, docks, bay sounds, mansion elements, office furniture"""
-            else:
-                location_context = f"""LOCATION: {scene_location}
+        else:
+            location_context = f"""LOCATION: {scene_location}
 - Stay consistent with this specific location
 - Do not mix elements from other scenes"""
 
-            # Build conversation history context
-            history_context = ""
-            if self.conversation_history:
-                print(
-                    f"DEBUG: Building history context with {len(self.conversation_history)} interactions"
-                )
-                print(
-                    f"DEBUG: Conversation history items: {[h['user'][:50] for h in self.conversation_history]}"
-                )
-                history_context = """📜 CONVERSATION HISTORY - EVERYTHING THAT HAS HAPPENED IN THIS SCENE:
-(Characters REMEMBER all of this. You MUST maintain continuity with these exchanges.)
-
-"""
-                for i, interaction in enumerate(self.conversation_history, 1):
-                    # Include FULL conversation, not truncated
-                    history_context += f"Exchange {i}:\n"
-                    history_context += f"Player asked/did: {interaction['user']}\n"
-                    history_context += f"You responded: {interaction['response']}\n"
-                    history_context += "---\n\n"
-                    print(
-                        f"DEBUG: Added exchange {i} to context - User: '{interaction['user'][:40]}...'"
-                    )
-                history_context += """⚠️ CRITICAL CONTINUITY RULES:
-- Characters REMEMBER everything from these exchanges
-- QUOTED DIALOGUE = CHARACTER SPEECH: Anything in quotes is what a character said out loud
-- If a character mentioned someone (like Dr. Whitmore), they KNOW about them in future responses
-- If a character said something in quotes, they SAID IT - track their knowledge accordingly
-- If information was revealed, it STAYS revealed - don't contradict it
-- Build on what was said, don't reset or forget
-- Maintain consistent character knowledge and awareness
-- Example: If Vivian said "I don't know any Dr. Whitmore" then she DOESN'T know Dr. Whitmore
-
-"""
-            else:
-                print("DEBUG: No conversation history available for context")
-
-            # Build list of already described elements
-            already_described = ""
-            if self.described_elements:
-                already_described = f"""🚫 ALREADY DESCRIBED IN THIS SCENE - ABSOLUTELY DO NOT MENTION AGAIN:
-{', '.join(sorted(self.described_elements))}
-
-⚠️ CRITICAL: You MUST NOT re-describe any of these elements. 
-- If "Thomas description" is listed, DO NOT describe Thomas as nervous, a wreck, anxious, etc.
-- If "Vivian appearance" is listed, DO NOT mention her eyes, hair, perfume, or jewelry
-- If character descriptions are listed, refer to them by NAME ONLY with NO descriptive words
-- Focus ONLY on what is NEW in this moment - new actions, new dialogue, new discoveries
-- Example: Write "Thomas speaks" NOT "The nervous butler speaks"
-"""
-
-            # Build list of canonical facts (immutable from story definition)
-            canonical_facts_context = ""
-            if self.canonical_facts:
-                canonical_facts_context = """⚠️ CANONICAL STORY FACTS - ABSOLUTELY IMMUTABLE (NEVER CHANGE THESE):
-"""
-                for i, fact in enumerate(self.canonical_facts, 1):
-                    canonical_facts_context += f"{i}. {fact}\n"
-                canonical_facts_context += """
-🔒 LOCKED: These facts are PERMANENT and UNCHANGEABLE. They define the core story elements.
-- Character names NEVER change (Thomas is always Thomas, Vivian is always Vivian)
-- The Algerian Eagle is ALWAYS the statue's name - never "Maltese Falcon" or any other name
-- Vivian's uncle was killed - this NEVER changes
-- The paperweight connection NEVER changes
-- ALL canonical facts must be referenced EXACTLY as written above
-
-"""
-
-            # Build list of established story facts that must remain consistent
-            story_facts_context = ""
-            if self.story_facts:
-                story_facts_context = """ESTABLISHED FACTS FROM GAMEPLAY - THESE MUST REMAIN CONSISTENT:
-"""
-                for i, fact in enumerate(self.story_facts, 1):
-                    story_facts_context += f"{i}. {fact}\n"
-                story_facts_context += """
-CRITICAL: These facts emerged during gameplay and are LOCKED IN. You CANNOT contradict them. If a character said they saw something, they cannot later deny it. If evidence was discovered, it stays discovered. Build on these facts, don't reverse them.
+        return {
+            "system": tuple(system_sections),
+            "location lock": Section(
+                "location lock", f"LOCATION CONTEXT: {location_context}\n\n", True
+            ),
+            "canonical facts": Section(
+                "canonical facts", self.canonical_facts_prompt(), True
+            ),
+            "closing": Section(
+                "closing",
+                "Respond to this input with NEW content that continues from where we left off:",
+                True,
+            ),
+        }
 
-"""
+    def prompt_state_fingerprint(self):
+        """Fingerprint of the state-dependent sections of the contextual prompt"""
+        return state_fingerprint(
+            self.current_story["title"],
+            self.current_scene,
+            self.described_elements,
+            self.story_facts,
+            self.conversation_history,
+        )
 
-            user_message = f"""USER INPUT: {user_input}
+    def anti_repetition_rules(self):
+        if self.runtime.compact_rules:
+            return COMPACT_ANTI_REPETITION_RULES
+        return ANTI_REPETITION_RULES
 
-LOCATION CONTEXT: {location_context}
+    def avoid_repetition(self, content):
+        """Count, trim or rewrite sentences that re-describe what the player has read"""
+        guard = self.runtime.repetition
+        if not guard.enabled or not content:
+            return content
+        index = guard.index(
+            self.scene_shingles,
+            [interaction["response"] for interaction in self.conversation_history],
+        )
+        repeated = guard.check(index, content)
+        if not repeated:
+            return content
+        print(f"DEBUG: {len(repeated)} repeated sentences in response")
+        if not guard.edits:
+            return content
+        if guard.action == "rewrite":
+            try:
+                rewritten = self.rewrite_without(content, repeated)
+                if rewritten and not guard.repeated_sentences(index, rewritten):
+                    guard.rewrites += 1
+                    return rewritten
+            except Exception as e:
+                print(f"Rewrite failed, trimming instead: {e}")
+        return guard.trim(content, repeated)
+
+    def rewrite_without(self, content, repeated):
+        """Ask the model to rewrite a reply without the repeated passages"""
+        passages = "\n".join(f"- {sentence}" for sentence in repeated)
+        result = self.runtime.model_router.complete(
+            CALL_CONTEXTUAL,
+            "You edit passages from an interactive story. Keep the voice, events and dialogue; change nothing else.",
+            f"""The player has already read these sentences earlier in the scene:
+{passages}
+
+Rewrite the passage below so it doesn't repeat them. Drop or replace those descriptions with new detail, and keep everything else.
+
+PASSAGE:
+{content}""",
+            max_tokens=600,
+            temperature=0.5,
+            owner=self.session_id,
+        )
+        self.track_usage(result)
+        return finish_text(result.content)
+
+    def clone(self):
+        """Copy of the story state, for generating replies outside this request"""
+        # Calls made from other threads still count toward this player's share
+        other = AdventureBot(self.runtime, sid=self.session_id)
+        other.current_story = self.current_story
+        other.current_scene = self.current_scene
+        other.conversation_history = list(self.conversation_history)
+        other.described_elements = set(self.described_elements)
+        other.story_facts = list(self.story_facts)
+        other.canonical_facts = self.canonical_facts
+        other.scene_shingles = self.scene_shingles
+        return other
+
+    def request_contextual_completion(self, user_input, priority=PRIORITY_INTERACTIVE):
+        """Ask the model for a reply to user_input without tracking any state"""
+        system_sections, user_sections = self.contextual_prompt_sections(user_input)
+        system_message = join_sections(system_sections)
+        user_message = join_sections(user_sections)
+
+        # Generate response using the provider routed for free-form turns
+        # Lower temperature (0.5) for more consistent, factual responses
+        result = self.runtime.model_router.complete(
+            CALL_CONTEXTUAL,
+            system_message,
+            user_message,
+            max_tokens=600,
+            temperature=0.5,
+            user_input=user_input,
+            priority=priority,
+            owner=self.session_id,
+        )
+        self.runtime.prompt_anatomy.record(
+            CALL_CONTEXTUAL, system_sections, user_sections, result.input_tokens
+        )
+        self.track_usage(result)
 
-{already_described}
+        # Check if response was cut off mid-sentence
+        result.content = finish_text(result.content)
+        return result
 
-{canonical_facts_context}{story_facts_context}
+    def estimate_contextual_cost(self, user_input):
+        system_message, user_message = self.build_contextual_prompt(user_input)
+        return self.runtime.model_router.estimate_cost(
+            CALL_CONTEXTUAL, system_message, user_message, 600, user_input
+        )
 
-{history_context}Respond to this input with NEW content that continues from where we left off:"""
+    def start_choice_speculation(self, scene_outline):
+        """Pre-generate replies to the scene's choices while the player reads it"""
+        choices = [
+            choice
+            for choice in self.extract_choices_from_outline(scene_outline)
+            if choice != "Continue..."
+        ]
+        if not choices:
+            self.runtime.speculator.discard(self.session_id)
+            return
+        snapshot = self.clone()
+        self.runtime.speculator.start(
+            self.session_id,
+            snapshot.prompt_state_fingerprint(),
+            choices,
+            lambda choice: snapshot.request_contextual_completion(
+                choice, PRIORITY_BACKGROUND
+            ),
+            snapshot.estimate_contextual_cost,
+        )
 
-            # Generate response using configured AI provider
-            # Lower temperature (0.5) for more consistent, factual responses
-            if AI_PROVIDER == "anthropic":
-                response = anthropic_client.messages.create(
-                    model=ANTHROPIC_MODEL,
-                    max_tokens=600,
-                    temperature=0.5,
-                    system=system_message,
-                    messages=[{"role": "user", "content": user_message}],
-                )
-                content = response.content[0].text
-            else:
-                response = openai_client.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": user_message},
-                    ],
-                    max_tokens=600,
-                    temperature=0.5,
+    def generate_contextual_response(self, user_input):
+        """Generate a contextual response to user input using AI"""
+        try:
+            # A reply pre-generated for one of the scene's choices, if the input
+            # matches one and nothing has happened since it was generated
+            content = self.runtime.speculator.take(
+                self.session_id, self.prompt_state_fingerprint(), user_input
+            )
+            if content is not None:
+                self.turn_source = "speculation"
+
+            # With no history or gameplay facts yet, the prompt is the same for every
+            # player in this scene, so common opening actions can be served from cache
+            opening_key = None
+            if not self.conversation_history and not self.story_facts:
+                opening_key = (
+                    self.current_story["title"],
+                    self.current_scene,
+                    normalize_input(user_input),
+                    state_fingerprint(
+                        self.described_elements,
+                        self.story_facts,
+                        self.conversation_history,
+                    ),
                 )
-                content = response.choices[0].message.content
+            if content is None and opening_key:
+                content = self.runtime.opening_cache.get(opening_key)
+                if content is not None:
+                    self.turn_source = "opening_cache"
+                    print(
+                        f"DEBUG: Opening action served from cache: '{user_input[:50]}'"
+                    )
+            elif content is not None and opening_key:
+                self.runtime.opening_cache.add(opening_key, content)
 
-            # Check if response was cut off mid-sentence
-            if content and not content.rstrip().endswith(
-                (".", "!", "?", '"', "'", "...", ":")
-            ):
-                # Add ellipsis if it seems incomplete
-                content = content.rstrip() + "..."
+            if content is None:
+                content = self.request_contextual_completion(user_input).content
+                self.turn_source = "provider"
+                if opening_key and content:
+                    self.runtime.opening_cache.add(opening_key, content)
+
+            content = self.avoid_repetition(content)
 
             # Track described elements to prevent repetition
             self.extract_described_elements(content, self.current_scene)
@@ -868,6 +1499,9 @@ LOCATION CONTEXT: {location_context}
 
             return content
 
+        except ProviderBusy:
+            # Surface as a 503 instead of an in-story error message
+            raise
         except Exception as e:
             print(f"AI contextual response failed: {e}")
             print(f"Error type: {type(e)}")
@@ -956,31 +1590,65 @@ LENGTH: 2-3 paragraphs with vivid action
 """
         return ""
 
-    def generate_scene_content(self, scene_outline, story_context):
-        """Generate rich content from scene outline using ChatGPT"""
-        try:
-            style_prompt = self.get_story_style_prompt(self.current_story["title"])
-
-            # Build canonical facts context for scene generation
-            canonical_facts_for_scene = ""
-            if self.canonical_facts:
-                canonical_facts_for_scene = (
-                    "\n⚠️ CANONICAL STORY FACTS (NEVER CHANGE):\n"
-                )
-                for fact in self.canonical_facts:
-                    canonical_facts_for_scene += f"- {fact}\n"
-
-            # Structured for optimal caching - system message contains cacheable content
-            system_message = f"""You are a master storyteller specializing in classic genre fiction.
+    def scene_canonical_facts_prompt(self):
+        """Bulleted canonical facts block for scene expansion"""
+        return self.runtime.static_prompt(
+            self.current_story,
+            "scene_canonical_facts",
+            self._build_scene_canonical_facts_prompt,
+        )
 
-{style_prompt}
+    def _build_scene_canonical_facts_prompt(self):
+        # Build canonical facts context for scene generation
+        canonical_facts_for_scene = ""
+        if self.canonical_facts:
+            canonical_facts_for_scene = "\n⚠️ CANONICAL STORY FACTS (NEVER CHANGE):\n"
+            for fact in self.canonical_facts:
+                canonical_facts_for_scene += f"- {fact}\n"
+        return canonical_facts_for_scene
+
+    def build_scene_prompt(self, scene_outline):
+        """Build the system and user messages for a scene expansion"""
+        system_sections, user_sections = self.scene_prompt_sections(scene_outline)
+        return join_sections(system_sections), join_sections(user_sections)
+
+    def scene_prompt_sections(self, scene_outline):
+        """The scene expansion prompt as named system and user message sections"""
+        system_sections = self.runtime.static_prompt(
+            self.current_story, "scene_system", self._build_scene_system_sections
+        )
 
-STORY CONTEXT:
+        # User message contains the variable content
+        user_sections = [
+            Section("outline", f"SCENE OUTLINE TO EXPAND:\n{scene_outline}\n\n", True),
+            Section("closing", "Generate the expanded scene now:", True),
+        ]
+        return list(system_sections), user_sections
+
+    def _build_scene_system_sections(self):
+        style_prompt = self.style_prompt()
+        canonical_facts_for_scene = self.scene_canonical_facts_prompt()
+
+        # Structured for optimal caching - system message contains cacheable content
+        system_sections = [
+            Section(
+                "preamble",
+                "You are a master storyteller specializing in classic genre fiction.\n\n",
+                True,
+            ),
+            Section("style", style_prompt + "\n\n", True),
+            Section(
+                "story context",
+                f"""STORY CONTEXT:
 Title: {self.current_story['title']}
 Previous scenes have established the characters and setting.
-{canonical_facts_for_scene}
-
-STANDARD INSTRUCTIONS:
+""",
+                True,
+            ),
+            Section("canonical facts", canonical_facts_for_scene + "\n\n", True),
+            Section(
+                "rules",
+                """STANDARD INSTRUCTIONS:
 1. Expand this outline into a rich, detailed scene
 2. Add atmospheric descriptions, dialogue, and sensory details
 3. Maintain the established character voices and relationships
@@ -991,94 +1659,71 @@ STANDARD INSTRUCTIONS:
 8. CRITICAL: Use EXACT names from canonical facts - never invent alternatives
 8. Format with clear paragraph breaks - use double line breaks between paragraphs
 9. ALWAYS complete your sentences - never end mid-sentence or mid-thought
-10. Focus on NEW story elements and progression - avoid repeating previous scene descriptions"""
-
-            # User message contains the variable content
-            user_message = f"""SCENE OUTLINE TO EXPAND:
-{scene_outline}
+10. Focus on NEW story elements and progression - avoid repeating previous scene descriptions""",
+                True,
+            ),
+        ]
+        return tuple(system_sections)
 
-Generate the expanded scene now:"""
+    def generate_scene_content(self, scene_outline, story_context):
+        """Generate rich content from scene outline using ChatGPT"""
+        try:
+            system_sections, user_sections = self.scene_prompt_sections(scene_outline)
+            system_message = join_sections(system_sections)
+            user_message = join_sections(user_sections)
 
-            # Generate response using configured AI provider
+            # Scene expansions are shared by all players once enough variants exist
+            story_index = self.story_arcs.index(self.current_story)
+            prompt_hash = state_fingerprint(system_message, user_message)
+            content = self.runtime.scene_cache.get(
+                story_index, self.current_scene, prompt_hash
+            )
+            if content is not None:
+                self.turn_source = "scene_cache"
+                print(f"DEBUG: Scene {self.current_scene} served from scene cache")
+                # Track described elements from generated scene to prevent repetition
+                self.extract_described_elements(content, self.current_scene)
+                return content
+
+            # Generate response using the provider routed for scene expansion
             # Lower temperature (0.5) for scene generation to maintain consistency
-            if AI_PROVIDER == "anthropic":
-                response = anthropic_client.messages.create(
-                    model=ANTHROPIC_MODEL,
-                    max_tokens=1000,
-                    temperature=0.5,
-                    system=system_message,
-                    messages=[{"role": "user", "content": user_message}],
-                )
-                content = response.content[0].text
-
-                # Log usage statistics for Anthropic
-                usage = response.usage
-                input_tokens = usage.input_tokens
-                output_tokens = usage.output_tokens
-
-                # Anthropic pricing (Claude 3.5 Sonnet)
-                input_cost = input_tokens * 0.003 / 1000
-                output_cost = output_tokens * 0.015 / 1000
-                total_cost = input_cost + output_cost
-
-                print(f"Usage: {input_tokens} input, {output_tokens} output")
-                print(f"Cost: ${total_cost:.4f}")
-            else:
-                response = openai_client.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": user_message},
-                    ],
-                    max_tokens=1000,
-                    temperature=0.5,
-                )
-
-                # Log usage statistics including caching
-                usage = response.usage
-                total_tokens = usage.total_tokens
-
-                # Check for cached tokens (available in newer API responses)
-                cached_tokens = 0
-                if (
-                    hasattr(usage, "prompt_tokens_details")
-                    and usage.prompt_tokens_details
-                ):
-                    cached_tokens = getattr(
-                        usage.prompt_tokens_details, "cached_tokens", 0
-                    )
-
-                # Calculate costs
-                input_cost = (
-                    (usage.prompt_tokens - cached_tokens) * 0.0025 / 1000
-                )  # Regular input tokens
-                cached_cost = (
-                    cached_tokens * 0.00125 / 1000
-                )  # Cached tokens (50% discount)
-                output_cost = usage.completion_tokens * 0.01 / 1000
-                total_cost = input_cost + cached_cost + output_cost
-
-                print(
-                    f"Usage: {usage.prompt_tokens} input ({cached_tokens} cached), {usage.completion_tokens} output"
-                )
-                print(
-                    f"Cost: ${total_cost:.4f} (saved ${cached_tokens * 0.00125 / 1000:.4f} from caching)"
-                )
-
-                content = response.choices[0].message.content
+            result = self.runtime.model_router.complete(
+                CALL_SCENE,
+                system_message,
+                user_message,
+                max_tokens=1000,
+                temperature=0.5,
+                owner=self.session_id,
+            )
+            content = result.content
+            log_usage(result)
+            self.turn_source = "provider"
+            self.track_usage(result)
+            self.runtime.prompt_anatomy.record(
+                CALL_SCENE, system_sections, user_sections, result.input_tokens
+            )
 
             # Check if response was cut off mid-sentence
-            if content and not content.rstrip().endswith(
-                (".", "!", "?", '"', "'", "...", ":")
-            ):
-                # Add ellipsis if it seems incomplete
-                content = content.rstrip() + "..."
+            content = finish_text(content)
+
+            self.runtime.scene_cache.add(
+                story_index,
+                self.current_scene,
+                prompt_hash,
+                content,
+                model=result.model,
+                input_tokens=result.input_tokens,
+                output_tokens=result.output_tokens,
+                cost=round(result.cost, 6),
+            )
 
             # Track described elements from generated scene to prevent repetition
             self.extract_described_elements(content, self.current_scene)
 
             return content
 
+        except ProviderBusy:
+            raise
         except Exception as e:
             # Fallback to original outline if AI fails
             print(f"AI generation failed: {e}")
@@ -1089,41 +1734,567 @@ Generate the expanded scene now:"""
             return f"AI Error: {str(e)}\n\nFallback: {scene_outline}"
 
 
-bot = AdventureBot()
+bp = Blueprint("adventure", __name__)
 
 
-@app.route("/")
+def get_runtime():
+    return current_app.extensions["cliffhanger"]
+
+
+def read_stored_session(app, sid):
+    interface = app.session_interface
+    return interface.cache.get(interface.key_prefix + sid)
+
+
+def write_stored_session(app, sid, data):
+    interface = app.session_interface
+    interface.cache.set(
+        interface.key_prefix + sid,
+        dict(data),
+        int(app.permanent_session_lifetime.total_seconds()),
+    )
+
+
+def apply_job_state(take=False):
+    """Bring this request's session up to date with the player's finished jobs"""
+    state = get_runtime().jobs.session_state(session.sid, take=take)
+    if state is not None:
+        session.clear()
+        session.update(copy.deepcopy(state))
+
+
+def load_bot():
+    """A bot for this request, loaded from the player's session"""
+    # Turns apply in order: wait for the player's queued jobs to finish first
+    runtime = get_runtime()
+    if not runtime.jobs.wait_idle(session.sid, runtime.job_wait_timeout):
+        raise JobsPending()
+    apply_job_state(take=True)
+    bot = AdventureBot(get_runtime())
+    bot.load_from_session()
+    return bot
+
+
+def logged_turn(kind, value, turn):
+    """Wrap a turn so it is added to the event log when it finishes"""
+
+    def run(bot):
+        started = time.perf_counter()
+        response = None
+        status = "error"
+        try:
+            response = turn(bot)
+            status = "ok"
+            return response
+        except ProviderBusy:
+            status = "busy"
+            raise
+        finally:
+            bot.runtime.events.record(
+                bot.turn_event(
+                    kind, value, response, status, time.perf_counter() - started
+                )
+            )
+
+    return run
+
+
+def session_version():
+    """Changes with every saved turn, so repeating an input later is a new turn"""
+    return zlib.crc32(session.get("state") or b"")
+
+
+def admit_turn(sid):
+    """Count a turn against its session's and its client address's rate limits"""
+    runtime = get_runtime()
+    runtime.address_limits.admit(request.remote_addr)
+    runtime.player_limits.admit(sid)
+
+
+def run_turn_once(endpoint, value, turn):
+    """Run a turn at most once per (session, endpoint, normalized input, state)
+
+    The first request runs the turn and writes history. Identical requests that
+    loaded the same session state get its response and copy its session state,
+    so their own session save can't overwrite the result with stale data.
+    """
+    key = (session.sid, endpoint, normalize_input(value), session_version())
+
+    def run():
+        # Only the turn that runs counts toward the player's rate limit
+        admit_turn(session.sid)
+        return turn(load_bot()), copy.deepcopy(dict(session))
+
+    (result, state), shared = get_runtime().turn_flights.do(key, run)
+    if shared:
+        session.clear()
+        session.update(state)
+    return result
+
+
+def submit_turn_job(endpoint, value, turn):
+    """Queue a turn to run on the job workers; responds 202 with the job
+
+    The worker loads the player's stored session, runs the turn and writes the
+    session back, so the result is kept even if the player never polls for it.
+    """
+    app = current_app._get_current_object()
+    runtime = get_runtime()
+    sid = session.sid
+    # The job reads the stored session, so store this request's copy first
+    if session:
+        write_stored_session(app, sid, session)
+
+    def run(job):
+        data = read_stored_session(app, sid) or {}
+        bot = AdventureBot(runtime, data, sid)
+        bot.load_from_session()
+        result = turn(bot)
+        if data:
+            write_stored_session(app, sid, data)
+        job.state = data
+        return result
+
+    def submit():
+        admit_turn(sid)
+        return runtime.jobs.submit(sid, endpoint, run)
+
+    # A double-clicked submission gets the job queued by the first click
+    key = (sid, endpoint, normalize_input(value), session_version(), "job")
+    job, _ = runtime.turn_flights.do(key, submit)
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return response
+
+
+@bp.app_errorhandler(JobsPending)
+def jobs_pending(error):
+    print(f"Turn waited too long for jobs: {error}")
+    response = jsonify(
+        {
+            "message": f"The storyteller is still writing your last scene. Please try again in {error.retry_after} seconds.",
+            "busy": True,
+            "retry_after": error.retry_after,
+        }
+    )
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@bp.app_errorhandler(JobQueueFull)
+def job_queue_full(error):
+    print(f"Rejected job: {error}")
+    response = jsonify(
+        {
+            "message": f"The storyteller has too many scenes in progress. Please try again in {error.retry_after} seconds.",
+            "busy": True,
+            "retry_after": error.retry_after,
+        }
+    )
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@bp.app_errorhandler(SlowDown)
+def slow_down(error):
+    print(f"Rate limited session: {error}")
+    response = jsonify(
+        {
+            "message": f"Slow down a little! The storyteller needs a moment. Please try again in {error.retry_after} seconds.",
+            "busy": True,
+            "slow_down": True,
+            "retry_after": error.retry_after,
+        }
+    )
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@bp.app_errorhandler(ProviderBusy)
+def provider_busy(error):
+    print(f"Rejected request: {error}")
+    response = jsonify(
+        {
+            "message": f"The storyteller is busy with other players right now. Please try again in {error.retry_after} seconds.",
+            "busy": True,
+            "retry_after": error.retry_after,
+        }
+    )
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@bp.after_app_request
+def finish_response(response):
+    runtime = get_runtime()
+    # Fingerprinted asset URLs change whenever the file does
+    if request.endpoint == "static" and request.args.get("v"):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = runtime.static_max_age
+        response.cache_control.immutable = True
+    return runtime.http_cache.compress_response(request, response)
+
+
+@bp.route("/")
 def home():
-    return render_template("index.html")
+    # Rendered once per worker; the debug server re-renders so template edits show
+    return get_runtime().http_cache.static_response(
+        request,
+        "index",
+        lambda: render_template("index.html", async_turns=get_runtime().async_turns),
+        "text/html",
+        memoize=not current_app.debug,
+    )
 
 
-@app.route("/api/stories", methods=["GET"])
+@bp.route("/api/stories", methods=["GET"])
 def get_stories():
-    return jsonify(
-        [{"id": i, "title": story["title"]} for i, story in enumerate(bot.story_arcs)]
+    return get_runtime().http_cache.static_response(
+        request,
+        "stories",
+        lambda: current_app.json.dumps(
+            [{"id": i, "title": story["title"]} for i, story in enumerate(STORY_ARCS)]
+        ),
+        "application/json",
     )
 
 
-@app.route("/api/start/<int:story_id>", methods=["POST"])
+@bp.route("/api/start/<int:story_id>", methods=["POST"])
 def start_story(story_id):
-    bot.load_from_session()
-    return jsonify(bot.start_story(story_id))
+    turn = logged_turn("start_story", story_id, lambda bot: bot.start_story(story_id))
+    return jsonify(turn(load_bot()))
 
 
-@app.route("/api/next", methods=["POST"])
+@bp.route("/api/next", methods=["POST"])
 def next_scene():
-    bot.load_from_session()
     data = request.get_json()
-    return jsonify(bot.next_scene(data.get("choice")))
+    choice = data.get("choice")
+    turn = logged_turn("next_scene", choice, lambda bot: bot.next_scene(choice))
+    if data.get("async") and get_runtime().async_turns:
+        return submit_turn_job("next", choice, turn)
+    return jsonify(run_turn_once("next", choice, turn))
 
 
-@app.route("/api/user-input", methods=["POST"])
+@bp.route("/api/user-input", methods=["POST"])
 def handle_user_input():
-    bot.load_from_session()
     data = request.get_json()
     user_input = data.get("input")
-    return jsonify(bot.handle_user_input(user_input))
+    turn = logged_turn(
+        "user_input", user_input, lambda bot: bot.handle_user_input(user_input)
+    )
+    if data.get("async") and get_runtime().async_turns:
+        return submit_turn_job("user-input", user_input, turn)
+    return jsonify(run_turn_once("user-input", user_input, turn))
+
+
+@bp.route("/api/transcript", methods=["GET"])
+def get_transcript():
+    """A page of the player's transcript, ending before ?before= (default: the end)"""
+    runtime = get_runtime()
+    player = session.get("player")
+    if not player:
+        return jsonify({"first": 0, "count": 0, "entries": []})
+    before = request.args.get("before", type=int)
+    limit = min(request.args.get("limit", runtime.transcripts.page_size, type=int), 100)
+    return jsonify(runtime.transcripts.read(player, before, limit))
+
+
+@bp.route("/api/checkpoints", methods=["GET"])
+def list_checkpoints():
+    """The player's scene checkpoints, oldest first"""
+    player = session.get("player")
+    entries = get_runtime().checkpoints.entries(player) if player else []
+    return jsonify(
+        [
+            dict(entry, title=STORY_ARCS[entry["story_index"]]["title"])
+            for entry in entries
+        ]
+    )
+
+
+@bp.route("/api/checkpoints/<checkpoint_id>", methods=["POST"])
+def restore_checkpoint(checkpoint_id):
+    """Resume from a checkpoint without generating anything"""
+    result = load_bot().restore_checkpoint(checkpoint_id)
+    if result is None:
+        return jsonify({"message": "Checkpoint not found"}), 404
+    return jsonify(result)
+
+
+@bp.route("/api/replay/<int:scene>", methods=["POST"])
+def replay_scene(scene):
+    """Replay the current story from the start of a scene the player reached"""
+    result = load_bot().replay_scene(scene)
+    if result is None:
+        return jsonify({"message": "No checkpoint for that scene"}), 404
+    return jsonify(result)
+
+
+def find_job(job_id):
+    job = get_runtime().jobs.get(job_id)
+    # Players can only see their own jobs
+    if job is None or job.sid != session.sid:
+        return None
+    return job
+
+
+@bp.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Poll a job: 202 while it is queued or running, 200 once it has finished"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+    if not job.done.is_set():
+        return jsonify(job.to_dict()), 202
+    # This request's own session save must not undo the job's turn
+    apply_job_state()
+    return jsonify(job.to_dict())
+
+
+@bp.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a job that hasn't started yet"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+    if not get_runtime().jobs.cancel(job_id):
+        return jsonify(job.to_dict()), 409
+    return jsonify(job.to_dict())
+
+
+@bp.route("/api/metrics", methods=["GET"])
+def metrics():
+    runtime = get_runtime()
+    return jsonify(
+        {
+            "providers": runtime.model_router.stats(),
+            "coalesced_requests": runtime.turn_flights.coalesced,
+            "player_limits": runtime.player_limits.stats(),
+            "address_limits": runtime.address_limits.stats(),
+            "opening_cache": runtime.opening_cache.stats(),
+            "speculation": runtime.speculator.stats(),
+            "scene_cache": runtime.scene_cache.stats(),
+            "session_sweep": runtime.session_sweeper.last_report,
+            "jobs": runtime.jobs.stats(),
+            "prompt_anatomy": runtime.prompt_anatomy.report(),
+            "repetition": runtime.repetition.stats(),
+            "checkpoints": runtime.checkpoints.stats(),
+            "event_log": runtime.events.stats(),
+        }
+    )
+
+
+@bp.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 only once this worker has finished warming up"""
+    status = get_runtime().warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+def create_app(config=None):
+    """Build the Flask app
+
+    `config` may be a dict of settings, a path to a .env-style or JSON file, or
+    None to read settings from the environment (and CLIFFHANGER_CONFIG if set).
+    Nothing provider-specific is imported until a provider is actually called.
+    """
+    if config is None or isinstance(config, str):
+        config = load_config(config)
+
+    app = Flask(__name__)
+    # Behind proxies, take the client address from X-Forwarded-For
+    proxies = setting(config, "TRUSTED_PROXIES", 0)
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+    app.secret_key = config.get("SECRET_KEY") or DEFAULT_SECRET_KEY
+
+    # Configure server-side session storage to handle large conversation histories
+    app.config["SESSION_TYPE"] = "filesystem"
+    app.config["SESSION_FILE_DIR"] = session_file_dir(config)
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_USE_SIGNER"] = True
+    if setting(config, "SESSION_SWEEP_INTERVAL", 3600):
+        # The sweeper bounds the store; cachelib's own pruning would otherwise
+        # rescan the whole directory inside a request once it passes 500 files
+        app.config["SESSION_FILE_THRESHOLD"] = 0
+    Session(app)
+
+    runtime = StoryRuntime(config)
+    app.extensions["cliffhanger"] = runtime
+    app.register_blueprint(bp)
+
+    # Warm up in the background; /ready reports 503 until it finishes. Servers
+    # that fork after loading the app (gunicorn preload) start these per worker
+    # instead, so threads and connection pools aren't lost or shared in the fork.
+    if setting(config, "START_BACKGROUND_TASKS", True):
+        runtime.start_background_tasks()
+    return app
+
+
+def serve_worker(config, sock, slot):
+    """Serve the app on a socket handed over by the supervisor (`--workers`)"""
+    from werkzeug.serving import make_server
+
+    # The supervisor adds the client's address to X-Forwarded-For
+    proxies = setting(config, "TRUSTED_PROXIES", 0) + 1
+    app = create_app(dict(config, TRUSTED_PROXIES=str(proxies)))
+    host, port = sock.getsockname()
+    print(f"✓ {slot} serving on port {port}")
+    make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+def reset_sessions(session_dir):
+    """Delete all stored session data"""
+    import shutil
+
+    if os.path.exists(session_dir):
+        shutil.rmtree(session_dir)
+        print("✓ Session data cleared - starting fresh")
+    else:
+        print("✓ No existing session data found - starting fresh")
+
+
+def main(argv=None):
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(
+        description="Cliffhanger Stories - Interactive Adventure Game"
+    )
+    parser.add_argument(
+        "--provider",
+        type=str,
+        choices=["openai", "claude"],
+        default=None,
+        help='AI provider to use: "openai" (default) or "claude" (Anthropic)',
+    )
+    parser.add_argument(
+        "--reset", action="store_true", help="Clear session data and start fresh"
+    )
+    parser.add_argument(
+        "--config", default=None, help="Settings file (.env-style or .json)"
+    )
+    parser.add_argument(
+        "--gc-sessions",
+        action="store_true",
+        help="Delete expired and least recently used sessions, then exit",
+    )
+    parser.add_argument(
+        "--prompt-report",
+        metavar="LOG",
+        default=None,
+        help="Print token use per prompt section from a PROMPT_ANATOMY_LOG file, then exit",
+    )
+    parser.add_argument(
+        "--event-report",
+        metavar="DIR",
+        default=None,
+        help="Summarize the turn events logged in an EVENT_LOG_DIR, then exit",
+    )
+    parser.add_argument(
+        "--prewarm-scenes",
+        action="store_true",
+        help="Generate scene variants for every story into the scene cache, then exit",
+    )
+    parser.add_argument(
+        "--prewarm-mode",
+        choices=["auto", "batch", "concurrent", "local"],
+        default="auto",
+        help="auto: batch API, falling back to concurrent calls; local: stand-in output in a temporary directory",
+    )
+    parser.add_argument(
+        "--variants",
+        type=int,
+        default=None,
+        help="Variants per scene to pre-warm (default: SCENE_CACHE_VARIANTS)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Run this many worker processes, routing each session to the same one",
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Address to listen on with --workers"
+    )
+    parser.add_argument("--port", type=int, default=5006)
+    args, unknown = parser.parse_known_args(argv)
+
+    # AI Provider Configuration
+    # Priority: command-line flag > config file > environment variable > default (openai)
+    overrides = {}
+    if args.provider:
+        # Map 'claude' to 'anthropic' internally
+        overrides["AI_PROVIDER"] = (
+            "anthropic" if args.provider == "claude" else "openai"
+        )
+        print(f"AI provider set via command-line: {args.provider}")
+    config = load_config(args.config, overrides)
+
+    # Only the CLI resets sessions, never a worker process importing the app
+    if args.reset:
+        reset_sessions(session_file_dir(config))
+
+    if args.gc_sessions:
+        report = StoryRuntime(config).session_sweeper.sweep_exclusive(wait=True)
+        print(
+            f"✓ Scanned {report['scanned']} sessions: removed {report['expired']} expired and {report['evicted']} evicted, reclaimed {report['reclaimed_bytes']} bytes"
+        )
+        print(
+            f"  {report['remaining_files']} sessions remain ({report['remaining_bytes']} bytes)"
+        )
+        return
+
+    if args.prompt_report:
+        anatomy = PromptAnatomy()
+        count = anatomy.load(args.prompt_report)
+        print(f"✓ Read {count} calls from {args.prompt_report}")
+        print(format_report(anatomy.report()))
+        return
+
+    if args.event_report:
+        events = list(read_events(args.event_report))
+        print(f"✓ Read {len(events)} events from {args.event_report}")
+        print(format_event_report(events))
+        return
+
+    if args.prewarm_scenes:
+        from scene_prewarm import ScenePrewarm
+
+        runtime = StoryRuntime(config)
+        totals = ScenePrewarm(
+            runtime,
+            args.variants or runtime.scene_cache.variants,
+            mode=args.prewarm_mode,
+            parallel=setting(config, "SCENE_PREWARM_PARALLEL", 4),
+            poll_seconds=setting(config, "SCENE_PREWARM_POLL_SECONDS", 30),
+        ).run()
+        print(
+            f"✓ Cached {totals['variants']} scene variants: {totals['input_tokens']} input and {totals['output_tokens']} output tokens, ${totals['cost']:.4f}"
+        )
+        return
+
+    if args.workers:
+        from supervisor import Supervisor
+
+        Supervisor(
+            serve_worker,
+            config,
+            workers=args.workers,
+            host=args.host,
+            port=args.port,
+            upstream_timeout=setting(config, "WORKER_TIMEOUT", 120),
+            max_body=int(setting(config, "MAX_REQUEST_KB", 1024.0) * 1024),
+        ).run()
+        return
+
+    app = create_app(config)
+    app.run(debug=True, port=args.port)
 
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5006)
+    main()
@@ -0,0 +1,69 @@
+"""Measure how often a player's turn lands on the worker that served them last
+
+    python benchmarks/affinity.py [--players 2000] [--turns 20] [--workers 4]
+
+Each simulated turn is routed to a worker and counts as a hit if that worker
+served the player's previous turn, as a per-process cache (speculated
+replies, the per-player rate limit) needs. Routing is compared as gunicorn
+does it (any worker), by session hash modulo the worker count, and on the
+supervisor's hash ring. Halfway through, one worker restarts: with modulo
+hashing most players change workers twice, on the ring only that worker's
+players do.
+"""
+
+import argparse
+import os
+import random
+import sys
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from supervisor import HashRing, _hash  # noqa: E402
+
+
+def simulate(route, players, turns, workers):
+    """Fraction of turns served by the player's previous worker"""
+    sids = [str(uuid.uuid4()) for _ in range(players)]
+    everyone = [f"worker-{i}" for i in range(workers)]
+    last = {}
+    hits = total = 0
+    for turn in range(turns):
+        # One worker is down for one turn in the middle of the run
+        up = everyone[1:] if turn == turns // 2 else everyone
+        for sid in sids:
+            worker = route(sid, up)
+            if sid in last:
+                total += 1
+                hits += last[sid] == worker
+            last[sid] = worker
+    return hits / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    rings = {}
+
+    def ring(sid, up):
+        key = tuple(up)
+        if key not in rings:
+            rings[key] = HashRing(up)
+        return rings[key].node_for(sid)
+
+    for label, route in (
+        ("any worker", lambda sid, up: random.choice(up)),
+        ("hash modulo", lambda sid, up: up[_hash(sid) % len(up)]),
+        ("hash ring", ring),
+    ):
+        rate = simulate(route, args.players, args.turns, args.workers)
+        print(f"{label:<12} {rate * 100:6.1f}% of turns on the previous worker")
+
+
+if __name__ == "__main__":
+    main()
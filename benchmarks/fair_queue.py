@@ -0,0 +1,120 @@
+"""Measure normal players' queue latency while one session floods the provider
+
+    python benchmarks/fair_queue.py [--seconds 5] [--players 8] [--flood 16]
+
+Simulated calls hold one of the provider's slots for a fixed time. Normal
+players start a turn every second or so. One abusive session keeps `--flood`
+calls in the queue at all times. Each configuration runs for `--seconds`:
+first-come-first-served queuing, fair queuing across sessions, and fair
+queuing with the abuser also held to the default per-player turn rate limit
+(normal players here play faster than people read, so they are not limited).
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from provider_limits import (  # noqa: E402
+    AdmissionController,
+    PlayerRateLimiter,
+    ProviderBusy,
+    SlowDown,
+)
+
+CALL_SECONDS = 0.05
+MAX_CONCURRENT = 4
+
+
+def call(controller, owner):
+    started = time.monotonic()
+    controller.acquire(100, owner=owner)
+    waited = time.monotonic() - started
+    time.sleep(CALL_SECONDS)
+    controller.release(100, call_seconds=CALL_SECONDS)
+    return waited + CALL_SECONDS
+
+
+def run(fair, rate_limit, seconds, players, flood):
+    controller = AdmissionController(
+        "simulated",
+        max_concurrent=MAX_CONCURRENT,
+        max_queue=1000,
+        queue_timeout=60.0,
+        fair=fair,
+    )
+    limits = PlayerRateLimiter(burst=5, per_minute=12 if rate_limit else 0)
+    stop = time.monotonic() + seconds
+    latencies = []
+    flood_calls = [0]
+    lock = threading.Lock()
+
+    def abuser():
+        while time.monotonic() < stop:
+            try:
+                limits.admit("abuser")
+            except SlowDown:
+                # A script ignoring Retry-After just tries again
+                time.sleep(0.01)
+                continue
+            call(controller, "abuser")
+            with lock:
+                flood_calls[0] += 1
+
+    def player(name):
+        time.sleep(random.random())
+        while time.monotonic() < stop:
+            try:
+                latency = call(controller, name)
+            except ProviderBusy:
+                continue
+            with lock:
+                latencies.append(latency)
+            time.sleep(0.8 + random.random() * 0.4)
+
+    threads = [threading.Thread(target=abuser) for _ in range(flood)]
+    threads += [
+        threading.Thread(target=player, args=(f"player-{i}",)) for i in range(players)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        "turns": len(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "flood_calls": flood_calls[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--flood", type=int, default=16)
+    args = parser.parse_args()
+
+    print(
+        f"{'queuing':<22} {'player turns':>12} {'p50 ms':>8} {'p99 ms':>8} {'flood calls':>12}"
+    )
+    for label, fair, rate_limit in (
+        ("first come", False, False),
+        ("fair", True, False),
+        ("fair + rate limit", True, True),
+    ):
+        result = run(fair, rate_limit, args.seconds, args.players, args.flood)
+        print(
+            f"{label:<22} {result['turns']:>12} {result['p50'] * 1000:>8.0f} "
+            f"{result['p99'] * 1000:>8.0f} {result['flood_calls']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure free-form prompt build time against session age
+
+    python benchmarks/prompt_build.py [--repeat 2000]
+
+For every session age (number of turns played in the scene) this times
+build_contextual_prompt twice: with the per-story and per-scene fragments
+memoized, as the app runs, and with the memo cleared before every build, as
+every turn used to be. Older sessions carry more history, story facts and
+described elements, which are the sections still built on each turn. Debug
+output is discarded so only prompt assembly is timed.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import (  # noqa: E402
+    DESCRIBED_ELEMENT_LABELS,
+    STORY_ARCS,
+    AdventureBot,
+    StoryRuntime,
+)
+
+AGES = [0, 1, 2, 4, 8, 15]
+
+
+def session_at(runtime, story, scene, age):
+    bot = AdventureBot(runtime, {}, "benchmark")
+    bot.current_story = story
+    bot.canonical_facts = story.get("canonical_facts", [])
+    bot.current_scene = scene
+    bot.conversation_history = [
+        {
+            "user": f"Look at the thing in corner {turn}",
+            "response": "You cross the room. " * 40,
+        }
+        for turn in range(age)
+    ]
+    bot.story_facts = [f"Fact number {turn} stays true" for turn in range(age * 2)]
+    bot.described_elements = set(DESCRIBED_ELEMENT_LABELS[: age * 2])
+    return bot
+
+
+def time_builds(runtime, bot, repeat, memoized):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            if not memoized:
+                runtime._static_prompts.clear()
+            bot.build_contextual_prompt("Open the desk drawer")
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    runtime = StoryRuntime({"START_BACKGROUND_TASKS": "false", "SCENE_CACHE_DIR": ""})
+    story = STORY_ARCS[0]
+    print(f"{'turns':>5} {'prompt chars':>13} {'rebuilt µs':>11} {'memoized µs':>12}")
+    for age in AGES:
+        bot = session_at(runtime, story, 1, age)
+        with contextlib.redirect_stdout(io.StringIO()):
+            system_message, user_message = bot.build_contextual_prompt(
+                "Open the desk drawer"
+            )
+        rebuilt = time_builds(runtime, bot, args.repeat, memoized=False)
+        memoized = time_builds(runtime, bot, args.repeat, memoized=True)
+        print(
+            f"{age:>5} {len(system_message) + len(user_message):>13} "
+            f"{rebuilt:>11.1f} {memoized:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Measure whether the anti-repetition rules can shrink
+
+    python benchmarks/repetition.py [--live TURNS]
+
+Without --live this compares the size of the full and compact rule text. With
+--live it plays TURNS scripted turns in every scene of every story, once with
+each rule set, through the configured provider (this spends tokens). The
+repetition check runs in measure-only mode and reports how often replies
+re-describe text the player has already read, along with input tokens per
+turn.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import (  # noqa: E402
+    ANTI_REPETITION_RULES,
+    COMPACT_ANTI_REPETITION_RULES,
+    STORY_ARCS,
+    AdventureBot,
+    StoryRuntime,
+)
+from provider_limits import estimate_tokens  # noqa: E402
+from repetition import split_sentences  # noqa: E402
+from settings import load_config  # noqa: E402
+
+# Actions that invite re-description of the scene
+TURNS = [
+    "Look around",
+    "What does the room look like?",
+    "Describe the person in front of me",
+    "Examine the most interesting object here",
+    "Wait and watch what happens",
+    "Ask what happened here",
+    "Look around again",
+    "Take a closer look at everyone present",
+]
+
+
+def play(rules, turns):
+    config = load_config(
+        overrides={
+            "ANTI_REPETITION_RULES": rules,
+            # Measure raw replies; nothing served from caches or speculation
+            "REPETITION_ACTION": "off",
+            "OPENING_CACHE_SIZE": "0",
+            "SPECULATION_MAX_COST_PER_HOUR": "0",
+            "SCENE_CACHE_VARIANTS": "0",
+            "CHECKPOINTS_PER_PLAYER": "0",
+            "TRANSCRIPT_MAX_TURNS": "0",
+            "START_BACKGROUND_TASKS": "false",
+        }
+    )
+    runtime = StoryRuntime(config)
+    guard = runtime.repetition
+    totals = {"replies": 0, "repeated": 0, "sentences": 0, "repeated_sentences": 0}
+    input_tokens = []
+    for story_index, story in enumerate(STORY_ARCS):
+        for scene in range(len(story["scenes"]) + 1):
+            bot = AdventureBot(runtime, {}, f"benchmark-{story_index}-{scene}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                bot.start_story(story_index)
+                for _ in range(scene):
+                    bot.next_scene("continue")
+            for user_input in TURNS[:turns]:
+                index = guard.index(
+                    bot.scene_shingles,
+                    [item["response"] for item in bot.conversation_history],
+                )
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = bot.request_contextual_completion(user_input)
+                    bot.conversation_history.append(
+                        {"user": user_input, "response": result.content}
+                    )
+                input_tokens.append(result.input_tokens)
+                repeated = guard.repeated_sentences(index, result.content)
+                sentences = sum(
+                    len(split_sentences(paragraph))
+                    for paragraph in result.content.split("\n\n")
+                )
+                totals["replies"] += 1
+                totals["repeated"] += bool(repeated)
+                totals["sentences"] += sentences
+                totals["repeated_sentences"] += len(repeated)
+    totals["avg_input_tokens"] = sum(input_tokens) / max(1, len(input_tokens))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--live", type=int, default=0, metavar="TURNS")
+    args = parser.parse_args()
+
+    full = estimate_tokens(ANTI_REPETITION_RULES)
+    compact = estimate_tokens(COMPACT_ANTI_REPETITION_RULES)
+    print(f"full rules:    ~{full} tokens per free-form turn")
+    print(
+        f"compact rules: ~{compact} tokens per free-form turn ({full - compact} fewer)"
+    )
+    if not args.live:
+        return
+
+    print(
+        f"\n{'rules':<8} {'replies':>8} {'with repeats':>13} {'repeated sent.':>15} {'input tokens':>13}"
+    )
+    for rules in ("full", "compact"):
+        totals = play(rules, args.live)
+        print(
+            f"{rules:<8} {totals['replies']:>8} "
+            f"{totals['repeated'] / max(1, totals['replies']):>13.0%} "
+            f"{totals['repeated_sentences'] / max(1, totals['sentences']):>15.1%} "
+            f"{totals['avg_input_tokens']:>13.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Compare memory and bytes on disk for legacy and compact session state
+
+    python benchmarks/session_state.py [--sizes 1000,10000,100000]
+
+Memory is for a population held in memory as unpickled legacy dicts, as
+decoded SessionState objects and as still-encoded bytes. Sessions are
+synthetic but shaped like real ones: up to 15 history entries,
+described-element labels and up to 40 tracked facts. Each population is
+loaded the way a worker would load it (unpickled or decoded), so strings are
+not shared between sessions unless the format shares them. Disk figures are
+the files Flask-Session writes, in bytes and in 4 KiB filesystem blocks.
+"""
+
+import argparse
+import os
+import pickle
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import DESCRIBED_ELEMENT_LABELS, STATE_CODEC, STORY_ARCS  # noqa: E402
+from story_state import SessionState  # noqa: E402
+
+# Vocabulary drawn from the stories so text compresses roughly like real turns
+WORDS = sorted(
+    {
+        word
+        for story in STORY_ARCS
+        for text in (story["intro"],) + story["scenes"]
+        for word in text.split()
+    }
+)
+BLOCK = 4096
+# cachelib writes a 4-byte expiry header before the pickled session
+HEADER = 4
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def legacy_session(rng):
+    story_index = rng.randrange(len(STORY_ARCS))
+    history = [
+        {
+            "user": sentence(rng, rng.randint(3, 10)),
+            "response": " ".join(sentence(rng, 14) for _ in range(rng.randint(3, 8))),
+        }
+        for _ in range(rng.randint(0, 15))
+    ]
+    return {
+        "current_story_index": story_index,
+        "current_scene": rng.randint(0, len(STORY_ARCS[story_index]["scenes"])),
+        "conversation_history": history,
+        "described_elements": rng.sample(DESCRIBED_ELEMENT_LABELS, rng.randint(0, 15)),
+        "story_facts": [
+            sentence(rng, rng.randint(6, 20)) for _ in range(rng.randint(0, 40))
+        ],
+    }
+
+
+def compact_state(session):
+    return SessionState(
+        session["current_story_index"],
+        session["current_scene"],
+        [(item["user"], item["response"]) for item in session["conversation_history"]],
+        STATE_CODEC.element_ids(session["described_elements"]),
+        session["story_facts"],
+    )
+
+
+def deep_size(obj, seen):
+    """Bytes held by obj and everything it references, counting shared objects once"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict) or type(obj).__name__ == "mappingproxy":
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_size(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+
+def file_size(session):
+    return HEADER + len(pickle.dumps(session, pickle.HIGHEST_PROTOCOL))
+
+
+def blocks(size):
+    return -(-size // BLOCK) * BLOCK
+
+
+def measure(count, seed):
+    rng = random.Random(seed)
+    legacy, compact, blobs = [], [], []
+    legacy_bytes = compact_bytes = legacy_blocks = compact_blocks = 0
+    encode_seconds = decode_seconds = 0.0
+    for _ in range(count):
+        session = legacy_session(rng)
+        stored = pickle.dumps(session, pickle.HIGHEST_PROTOCOL)
+        legacy.append(pickle.loads(stored))
+        legacy_bytes += HEADER + len(stored)
+        legacy_blocks += blocks(HEADER + len(stored))
+
+        started = time.perf_counter()
+        blob = STATE_CODEC.encode(compact_state(session))
+        encode_seconds += time.perf_counter() - started
+        size = file_size({"state": blob})
+        compact_bytes += size
+        compact_blocks += blocks(size)
+        blobs.append(blob)
+
+        started = time.perf_counter()
+        compact.append(STATE_CODEC.decode(blob))
+        decode_seconds += time.perf_counter() - started
+
+    return {
+        "legacy_memory": deep_size(legacy, set()),
+        "compact_memory": deep_size(compact, set()),
+        "encoded_memory": deep_size(blobs, set()),
+        "legacy_disk": legacy_bytes,
+        "compact_disk": compact_bytes,
+        "legacy_blocks": legacy_blocks,
+        "compact_blocks": compact_blocks,
+        "encode_us": encode_seconds / count * 1e6,
+        "decode_us": decode_seconds / count * 1e6,
+    }
+
+
+def mb(value):
+    return f"{value / 1024 / 1024:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(
+        f"story_arcs copy no longer built per request: {deep_size(STORY_ARCS, set())} bytes"
+    )
+    columns = (
+        "sessions",
+        "legacy MB",
+        "compact MB",
+        "encoded MB",
+        "legacy disk",
+        "compact disk",
+        "legacy blk",
+        "compact blk",
+        "enc us",
+        "dec us",
+    )
+    print(" ".join(f"{name:>12}" for name in columns))
+    for count in (int(size) for size in args.sizes.split(",")):
+        r = measure(count, args.seed)
+        values = [
+            count,
+            mb(r["legacy_memory"]),
+            mb(r["compact_memory"]),
+            mb(r["encoded_memory"]),
+            mb(r["legacy_disk"]),
+            mb(r["compact_disk"]),
+            mb(r["legacy_blocks"]),
+            mb(r["compact_blocks"]),
+            f"{r['encode_us']:.1f}",
+            f"{r['decode_us']:.1f}",
+        ]
+        print(" ".join(f"{value:>12}" for value in values))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measure cold import, app creation and first-request latency
+
+    python benchmarks/startup.py [--runs 5]
+
+Each run starts a fresh interpreter so nothing is shared between runs.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+app = app_module.create_app(
+    {"SESSION_FILE_DIR": sys.argv[1], "START_BACKGROUND_TASKS": "false"}
+)
+t2 = time.perf_counter()
+client = app.test_client()
+client.get("/")
+t3 = time.perf_counter()
+client.get("/api/stories")
+t4 = time.perf_counter()
+print(json.dumps({
+    "import": t1 - t0,
+    "create_app": t2 - t1,
+    "first_page": t3 - t2,
+    "first_api": t4 - t3,
+    "sdks_loaded": sorted(m for m in ("openai", "anthropic") if m in sys.modules),
+}))
+"""
+
+
+def run_once(session_dir):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, session_dir],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    # The app prints its routing table; the measurements are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as session_dir:
+        runs = [run_once(session_dir) for _ in range(args.runs)]
+
+    print(f"{'phase':<12} {'median ms':>10} {'max ms':>10}")
+    for phase in ("import", "create_app", "first_page", "first_api"):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<12} {statistics.median(values):>10.1f} {max(values):>10.1f}")
+    print(f"provider SDKs imported at startup: {runs[-1]['sdks_loaded'] or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from cachelib import FileSystemCache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from repetition import split_sentences
+
+SUMMARY_CHARS = 160
+
+# Players hash onto this many lock files, so their number stays bounded
+LOCK_STRIPES = 256
+
+
+def summarize(text):
+    """Opening sentence of a scene, for listing checkpoints"""
+    first = split_sentences(text.strip().split("\n\n")[0])[:1]
+    summary = first[0] if first else text.strip()
+    if len(summary) > SUMMARY_CHARS:
+        summary = summary[: SUMMARY_CHARS - 1].rstrip() + "…"
+    return summary
+
+
+class CheckpointStore:
+    """Story state snapshots taken at scene boundaries
+
+    Each checkpoint holds an encoded session state and the scene text the
+    player was shown, so resuming or replaying a scene is a single read with
+    no provider call. Checkpoints are files in their own directory, stored
+    under a random id, which is all a player needs to resume in a new
+    session. Each player's index lists their checkpoints oldest first; past
+    `per_player`, the oldest are deleted. Index updates hold a lock file
+    named by a hash of the player id, in `<directory>.locks`, so worker
+    processes sharing the directory don't lose each other's entries and
+    different players' saves rarely wait on each other.
+    """
+
+    def __init__(self, directory, per_player=10, timeout=0, threshold=0):
+        self.directory = directory
+        self.per_player = per_player
+        self.timeout = timeout
+        self.threshold = threshold
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.saved = 0
+        self.restored = 0
+        self.pruned = 0
+
+    @property
+    def enabled(self):
+        return self.per_player > 0
+
+    @property
+    def cache(self):
+        # Created on first use, so tools that never checkpoint don't create the directory
+        if self._cache is None:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = FileSystemCache(
+                        self.directory, threshold=self.threshold
+                    )
+        return self._cache
+
+    @contextmanager
+    def _player_lock(self, player):
+        digest = hashlib.sha1(str(player).encode("utf-8")).digest()
+        stripe = int.from_bytes(digest[:4], "big") % LOCK_STRIPES
+        with self._locks[stripe]:
+            if fcntl is None:
+                yield
+                return
+            # Beside the cache directory, whose files are all taken for entries
+            lock_dir = os.path.abspath(self.directory).rstrip(os.sep) + ".locks"
+            os.makedirs(lock_dir, exist_ok=True)
+            with open(os.path.join(lock_dir, f"{stripe:02x}.lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def entries(self, player):
+        index = self.cache.get(f"checkpoints:{player}") or []
+        if not self.timeout:
+            return index
+        # Checkpoints expire on their own; don't list ones that are gone
+        cutoff = time.time() - self.timeout
+        return [entry for entry in index if entry["created"] > cutoff]
+
+    def save(self, player, story_index, scene, state, text, transcript=None):
+        """Store a checkpoint and return its index entry
+
+        `transcript` is the (transcript id, index) of the scene's entry.
+        """
+        entry = {
+            "id": secrets.token_urlsafe(12),
+            "story_index": story_index,
+            "scene": scene,
+            "summary": summarize(text),
+            "created": int(time.time()),
+            "transcript": list(transcript) if transcript else None,
+        }
+        self.cache.set(
+            f"checkpoint:{entry['id']}",
+            {
+                "player": player,
+                "entry": entry,
+                "state": state,
+                "text": zlib.compress(text.encode("utf-8")),
+            },
+            self.timeout,
+        )
+        with self._player_lock(player):
+            index = self.entries(player)
+            index.append(entry)
+            for old in index[: -self.per_player]:
+                self.cache.delete(f"checkpoint:{old['id']}")
+                self.pruned += 1
+            self.cache.set(
+                f"checkpoints:{player}", index[-self.per_player :], self.timeout
+            )
+            self.saved += 1
+        return entry
+
+    def load(self, checkpoint_id):
+        """(player, entry, encoded state, scene text), or None if it's gone"""
+        record = self.cache.get(f"checkpoint:{checkpoint_id}")
+        if record is None:
+            return None
+        self.restored += 1
+        text = zlib.decompress(record["text"]).decode("utf-8")
+        return record["player"], record["entry"], record["state"], text
+
+    def find(self, player, story_index, scene):
+        """The player's latest checkpoint for a scene, or None"""
+        for entry in reversed(self.entries(player)):
+            if entry["story_index"] == story_index and entry["scene"] == scene:
+                return entry
+        return None
+
+    def stats(self):
+        return {
+            "per_player": self.per_player,
+            "saved": self.saved,
+            "restored": self.restored,
+            "pruned": self.pruned,
+        }
@@ -0,0 +1,245 @@
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class EventLog:
+    """Turn events buffered in memory and written to disk in batches
+
+    `record` only appends to a ring buffer of `capacity` events, so turns never
+    wait on the disk. A background thread wakes every `flush_interval`
+    seconds, or once `batch_size` events are waiting, and appends them as one
+    gzip member to the current segment, a `.jsonl.gz` file that reads like any
+    gzipped JSON-lines file. Each process writes its own segments, which rotate
+    at `segment_bytes` or `segment_seconds`. Each process keeps its newest
+    `keep_segments` (0 keeps all), and as many from processes that have
+    exited. If the disk falls behind and the buffer fills, the oldest
+    buffered events are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        directory,
+        capacity=10000,
+        batch_size=500,
+        flush_interval=2.0,
+        segment_bytes=16 * 1024 * 1024,
+        segment_seconds=3600,
+        keep_segments=0,
+    ):
+        self.directory = directory
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.keep_segments = keep_segments
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._write_lock = threading.Lock()
+        self._pid = None
+        self._segment = None  # (path, opened_at)
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_writes = 0
+        self.segments = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.capacity > 0
+
+    def record(self, event):
+        """Queue an event for writing; never blocks on I/O"""
+        if not self.enabled:
+            return
+        if self._pid != os.getpid():
+            self.start()
+        with self._lock:
+            if len(self._buffer) >= self.capacity:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(event)
+            self.recorded += 1
+            waiting = len(self._buffer)
+        if waiting >= self.batch_size:
+            self._wake.set()
+
+    def start(self):
+        """Start the flush thread in this process (again after a fork)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # A forked worker must not append to its parent's segment
+            self._segment = None
+        threading.Thread(target=self._loop, name="event-log", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Event log flush failed: {e}")
+
+    def flush(self):
+        """Write everything buffered so far; returns the number written"""
+        with self._write_lock:
+            with self._lock:
+                batch = list(self._buffer)
+                self._buffer.clear()
+            if not batch:
+                return 0
+            lines = "".join(
+                json.dumps(event, separators=(",", ":")) + "\n" for event in batch
+            )
+            try:
+                path = self._segment_path()
+                with open(path, "ab") as f:
+                    with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as member:
+                        member.write(lines.encode("utf-8"))
+            except OSError as e:
+                self.failed_writes += 1
+                self.dropped += len(batch)
+                print(f"Warning: Could not write {len(batch)} events: {e}")
+                return 0
+            self.written += len(batch)
+            return len(batch)
+
+    def _segment_path(self):
+        now = time.time()
+        if self._segment is not None:
+            path, opened_at = self._segment
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            if size < self.segment_bytes and now - opened_at < self.segment_seconds:
+                return path
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now))
+        path = os.path.join(
+            self.directory, f"events-{stamp}-{os.getpid()}-{self.segments}.jsonl.gz"
+        )
+        self._segment = (path, now)
+        self.segments += 1
+        self._prune()
+        return path
+
+    def _prune(self):
+        """Delete this process's oldest segments, and those of exited processes
+
+        Other running workers' segments are left alone: they may still be
+        appending to them.
+        """
+        if not self.keep_segments:
+            return
+        own, orphaned = [], []
+        # Names start with the UTC time, so they sort oldest first
+        for name in sorted(os.listdir(self.directory)):
+            pid = segment_pid(name)
+            if pid == os.getpid():
+                own.append(name)
+            elif pid is not None and not process_running(pid):
+                orphaned.append(name)
+        # The new segment isn't on disk yet, so keep one fewer of our own
+        doomed = own[: max(0, len(own) - self.keep_segments + 1)]
+        doomed += orphaned[: max(0, len(orphaned) - self.keep_segments)]
+        for name in doomed:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "buffered": buffered,
+            "dropped": self.dropped,
+            "failed_writes": self.failed_writes,
+            "segments": self.segments,
+        }
+
+
+def segment_pid(name):
+    """The pid in a segment name (events-<date>-<time>-<pid>-<n>.jsonl.gz)"""
+    if not (name.startswith("events-") and name.endswith(".jsonl.gz")):
+        return None
+    parts = name.split("-")
+    if len(parts) != 5 or not parts[3].isdigit():
+        return None
+    return int(parts[3])
+
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running as another user
+    return True
+
+
+def read_events(directory):
+    """Every event in a directory's segments, oldest segment first"""
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("events-") and name.endswith(".jsonl.gz"):
+            with gzip.open(os.path.join(directory, name), "rt") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def format_event_report(events, top=5):
+    """Per turn type: latency, size, cost and sources; common inputs per scene"""
+    by_type = {}
+    inputs = {}
+    for event in events:
+        by_type.setdefault(event["type"], []).append(event)
+        if event["type"] == "user_input" and event.get("input"):
+            scene = inputs.setdefault((event["story"], event["scene"]), {})
+            text = " ".join(event["input"].lower().split())
+            scene[text] = scene.get(text, 0) + 1
+
+    lines = []
+    for kind, group in sorted(by_type.items()):
+        seconds = [event["seconds"] for event in group]
+        sources = {}
+        for event in group:
+            sources[event.get("source")] = sources.get(event.get("source"), 0) + 1
+        lines.append(
+            f"{kind}: {len(group)} turns, p50 {percentile(seconds, 0.5):.2f}s, p95 {percentile(seconds, 0.95):.2f}s, "
+            f"{sum(e['response_chars'] for e in group) / len(group):.0f} chars, "
+            f"${sum(e['cost'] for e in group):.4f} total"
+        )
+        lines.append(
+            "  sources: "
+            + ", ".join(
+                f"{source or 'none'} {count}"
+                for source, count in sorted(sources.items(), key=lambda item: -item[1])
+            )
+        )
+    for (story, scene), counts in sorted(
+        inputs.items(), key=lambda item: (str(item[0][0]), item[0][1])
+    ):
+        lines.append(f"story {story} scene {scene} common inputs:")
+        for text, count in sorted(counts.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"  {count:>5}  {text}")
+    return "\n".join(lines)
@@ -0,0 +1,33 @@
+# Gunicorn settings for running several workers behind one port
+# Usage: gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5006")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+# Turns spend most of their time waiting on the provider, so each worker
+# serves several requests at once on threads
+worker_class = "gthread"
+threads = int(os.getenv("WORKER_THREADS", "8"))
+
+# Scene expansions can take well over ten seconds
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+
+# Import the app once in the master and fork workers from it. create_app()
+# has no side effects beyond building the app, so this is safe, and provider
+# SDKs are only imported by workers when they make their first call.
+preload_app = True
+
+# Background threads (warm-up, session sweeper) don't survive a fork, and warm-up
+# opens provider connections, so the master doesn't start them; each worker
+# starts its own in post_fork instead
+raw_env = ["START_BACKGROUND_TASKS=false"]
+
+# Jobs live in the worker that queued them, and gunicorn may send the poll for
+# a job to any worker, so turns run inline unless routing is sticky
+raw_env.append(f"ASYNC_TURNS={os.getenv('ASYNC_TURNS', 'false')}")
+
+
+def post_fork(server, worker):
+    worker.app.wsgi().extensions["cliffhanger"].start_background_tasks()
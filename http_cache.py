@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+
+def compress(data, encoding, level=6):
+    if encoding == "br":
+        # Brotli quality runs 0-11; scale the gzip level onto it
+        return brotli.compress(data, quality=min(11, level + 3))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class HttpCache:
+    """Negotiated compression, strong ETags and fingerprinted asset URLs
+
+    Responses that never change while the app runs (the page, the story list)
+    are built once, hashed and compressed once per encoding, and answered with
+    304 when the client already has them. Each encoding gets its own ETag
+    ("<hash>-gzip"), as the representations differ byte for byte. Other
+    responses, such as turn payloads, are compressed as they go out.
+    """
+
+    def __init__(self, static_dir, min_size=500, level=6):
+        self.static_dir = static_dir
+        self.min_size = min_size
+        self.level = level
+        self._payloads = {}  # key -> {"etag": ..., None: body, "gzip": ...}
+        self._fingerprints = {}  # asset name -> (mtime, hash)
+        self._lock = threading.Lock()
+
+    def negotiate(self, request, size):
+        if size < self.min_size:
+            return None
+        return request.accept_encodings.best_match(ENCODINGS)
+
+    def static_response(self, request, key, build, mimetype, memoize=True):
+        """Response for content that only changes when the app is redeployed"""
+        entry = self._payloads.get(key) if memoize else None
+        if entry is None:
+            body = build().encode("utf-8")
+            entry = {"etag": hashlib.sha1(body).hexdigest(), None: body}
+            if memoize:
+                self._payloads[key] = entry
+        encoding = self.negotiate(request, len(entry[None]))
+        etag = f"{entry['etag']}-{encoding}" if encoding else entry["etag"]
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            body = entry.get(encoding)
+            if body is None:
+                body = entry[encoding] = compress(entry[None], encoding, self.level)
+            response = Response(body, mimetype=mimetype)
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        # Always revalidate; an unchanged page costs a 304 with no body
+        response.cache_control.no_cache = True
+        return response
+
+    def compress_response(self, request, response):
+        """Compress a dynamic response if the client accepts it"""
+        if (
+            response.direct_passthrough
+            or response.status_code != 200
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+        ):
+            return response
+        data = response.get_data()
+        encoding = self.negotiate(request, len(data))
+        response.vary.add("Accept-Encoding")
+        if encoding:
+            response.set_data(compress(data, encoding, self.level))
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    def asset_url(self, name):
+        """URL for a static file with a content hash, so it can be cached forever
+
+        Returns the bare name if the file doesn't exist.
+        """
+        path = os.path.join(self.static_dir, name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return name
+        cached = self._fingerprints.get(name)
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()[:12]
+            with self._lock:
+                self._fingerprints[name] = cached = (mtime, digest)
+        return f"/static/{name}?v={cached[1]}"
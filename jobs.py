@@ -0,0 +1,181 @@
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    """Raised when the queue already holds its maximum number of pending jobs"""
+
+    def __init__(self, retry_after=5):
+        self.retry_after = retry_after
+        super().__init__("Job queue is full")
+
+
+class JobsPending(Exception):
+    """Raised when a session's jobs are still running after the wait timeout"""
+
+    def __init__(self, retry_after=5):
+        self.retry_after = retry_after
+        super().__init__("Session still has jobs running")
+
+
+class Job:
+    def __init__(self, sid, kind, fn):
+        self.id = uuid.uuid4().hex
+        self.sid = sid
+        self.kind = kind
+        self.fn = fn
+        self.status = "queued"  # queued -> running -> done | failed | cancelled
+        self.result = None
+        self.state = None  # session data the job wrote, set by fn
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        data = {"id": self.id, "kind": self.kind, "status": self.status}
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Run long generations on a local worker pool
+
+    Jobs for the same session run one at a time in submission order, so turns
+    are applied to a player's state in the order they were requested. Queued
+    jobs can be cancelled. Finished jobs stay available for `result_ttl`
+    seconds so clients can collect them.
+    """
+
+    def __init__(self, workers=4, max_pending=64, result_ttl=600):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self._jobs = {}
+        self._session_queues = {}  # sid -> deque of jobs not yet finished
+        self._states = {}  # sid -> (finished, session data) from its last job
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def _pending(self):
+        return sum(len(queue) for queue in self._session_queues.values())
+
+    def _expire(self, now):
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished > self.result_ttl:
+                del self._jobs[job_id]
+        for sid, (finished, _) in list(self._states.items()):
+            if now - finished > self.result_ttl:
+                del self._states[sid]
+
+    def submit(self, sid, kind, fn):
+        """Queue fn(job) behind the session's other jobs; returns the Job"""
+        with self._lock:
+            self._expire(time.time())
+            if self._pending() >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFull()
+            job = Job(sid, kind, fn)
+            self._jobs[job.id] = job
+            queue = self._session_queues.setdefault(sid, deque())
+            queue.append(job)
+            if len(queue) == 1:
+                self._executor.submit(self._run, job)
+        print(f"DEBUG: Queued {kind} job {job.id}")
+        return job
+
+    def _run(self, job):
+        with self._lock:
+            if job.status == "cancelled":
+                self._advance(job)
+                return
+            job.status = "running"
+        try:
+            job.result = job.fn(job)
+            job.status = "done"
+            self.completed += 1
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+            self.failed += 1
+        with self._lock:
+            if job.status == "done" and job.state is not None:
+                self._states[job.sid] = (time.time(), job.state)
+            self._advance(job)
+
+    def _advance(self, job):
+        """Finish a job and start the next one for its session (lock held)"""
+        job.finished = time.time()
+        job.fn = None
+        job.done.set()
+        queue = self._session_queues.get(job.sid)
+        if queue and queue[0] is job:
+            queue.popleft()
+        if queue:
+            self._executor.submit(self._run, queue[0])
+        else:
+            self._session_queues.pop(job.sid, None)
+            self._idle.notify_all()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued job; jobs that already started can't be cancelled"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "queued":
+                return False
+            job.status = "cancelled"
+            self.cancelled += 1
+            queue = self._session_queues.get(job.sid)
+            if queue and queue[0] is not job:
+                # Not yet handed to a worker, so finish it here
+                queue.remove(job)
+                job.finished = time.time()
+                job.done.set()
+            # The head job is already submitted; _run will skip it
+            return True
+
+    def busy(self, sid):
+        with self._lock:
+            return sid in self._session_queues
+
+    def session_state(self, sid, take=False):
+        """Session data written by the session's last finished job, if any
+
+        Requests load the session before they run and save it when they finish,
+        so a request that overlapped a job would write back stale data. Applying
+        this state first keeps the job's turn.
+        """
+        with self._lock:
+            entry = self._states.pop(sid, None) if take else self._states.get(sid)
+        return entry[1] if entry else None
+
+    def wait_idle(self, sid, timeout=None):
+        """Block until the session has no queued or running jobs"""
+        with self._idle:
+            return self._idle.wait_for(lambda: sid not in self._session_queues, timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending(),
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+            }
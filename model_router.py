@@ -0,0 +1,317 @@
+import threading
+import time
+
+from provider_limits import (
+    PRIORITY_INTERACTIVE,
+    controller_from_config,
+    estimate_tokens,
+)
+from settings import setting
+
+# Default model for each provider when nothing more specific is configured
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-2024-11-20",
+    "anthropic": "claude-opus-4-20250514",
+}
+
+# Price per 1K tokens: (input, cached input, output), keyed by model name.
+# Dated snapshots match by prefix, so "gpt-4o-2024-11-20" is priced as "gpt-4o"
+PRICING = {
+    "gpt-4o": (0.0025, 0.00125, 0.01),
+    "gpt-4o-mini": (0.00015, 0.000075, 0.0006),
+    "gpt-4.1": (0.002, 0.0005, 0.008),
+    "gpt-4.1-mini": (0.0004, 0.0001, 0.0016),
+    "claude-opus-4": (0.015, 0.0015, 0.075),
+    "claude-sonnet-4": (0.003, 0.0003, 0.015),
+    "claude-3-5-sonnet": (0.003, 0.0003, 0.015),
+    "claude-3-5-haiku": (0.0008, 0.00008, 0.004),
+}
+
+# Models not listed above are priced as their provider's default model
+PROVIDER_PRICING = {
+    "openai": PRICING["gpt-4o"],
+    "anthropic": PRICING["claude-opus-4"],
+}
+
+# Call types issued by AdventureBot
+CALL_CONTEXTUAL = "contextual"  # free-form replies from generate_contextual_response
+CALL_SCENE = "scene"  # scene expansions from generate_scene_content
+CALL_FAST = "fast"  # short free-form inputs routed by heuristic
+
+
+def normalize_provider(name, fallback="openai"):
+    """Map a provider name (including the 'claude' alias) to openai/anthropic"""
+    if not name:
+        return fallback
+    name = name.strip().lower()
+    if name == "claude":
+        return "anthropic"
+    if name not in DEFAULT_MODELS:
+        print(f"Warning: Invalid provider '{name}', defaulting to '{fallback}'")
+        return fallback
+    return name
+
+
+def model_pricing(provider, model):
+    """Per-1K-token prices for a model, by its longest matching name prefix"""
+    matches = [name for name in PRICING if model and model.startswith(name)]
+    if matches:
+        return PRICING[max(matches, key=len)]
+    return PROVIDER_PRICING[provider]
+
+
+def default_model(config, provider):
+    """Model from OPENAI_MODEL / ANTHROPIC_MODEL, falling back to built-in defaults"""
+    return config.get(f"{provider.upper()}_MODEL") or DEFAULT_MODELS[provider]
+
+
+class Route:
+    def __init__(self, provider, model):
+        self.provider = provider
+        self.model = model
+
+    def __repr__(self):
+        return f"Route({self.provider}:{self.model})"
+
+
+class ModelResponse:
+    def __init__(
+        self,
+        content,
+        provider,
+        model,
+        input_tokens=0,
+        output_tokens=0,
+        cached_tokens=0,
+    ):
+        self.content = content
+        self.provider = provider
+        self.model = model
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+
+    @property
+    def cost(self):
+        """Estimated dollar cost of this call"""
+        input_price, cached_price, output_price = model_pricing(
+            self.provider, self.model
+        )
+        return (
+            (self.input_tokens - self.cached_tokens) * input_price / 1000
+            + self.cached_tokens * cached_price / 1000
+            + self.output_tokens * output_price / 1000
+        )
+
+    @property
+    def cache_savings(self):
+        """Dollars saved by prompt caching on this call"""
+        input_price, cached_price, _ = model_pricing(self.provider, self.model)
+        return self.cached_tokens * (input_price - cached_price) / 1000
+
+
+class ModelRouter:
+    """Pick a provider and model per call type and keep one client per provider"""
+
+    def __init__(self, default_provider, routes=None, fast_max_words=0, config=None):
+        self.config = config or {}
+        self.default_provider = normalize_provider(default_provider)
+        self.routes = routes or {}
+        # Free-form inputs with at most this many words use the fast route (0 disables)
+        self.fast_max_words = fast_max_words
+        self._clients = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build routes from <CALL_TYPE>_PROVIDER / <CALL_TYPE>_MODEL settings"""
+        default_provider = normalize_provider(config.get("AI_PROVIDER"))
+        routes = {}
+        for call_type in (CALL_CONTEXTUAL, CALL_SCENE, CALL_FAST):
+            prefix = call_type.upper()
+            provider = normalize_provider(
+                config.get(f"{prefix}_PROVIDER"), default_provider
+            )
+            model = config.get(f"{prefix}_MODEL")
+            if call_type == CALL_FAST and not model:
+                # The fast route is opt-in - without a model it is not configured
+                continue
+            routes[call_type] = Route(
+                provider, model or default_model(config, provider)
+            )
+        fast_max_words = setting(config, "FAST_ROUTE_MAX_WORDS", 4)
+        return cls(default_provider, routes, fast_max_words, config)
+
+    def route(self, call_type, user_input=None):
+        """Return the Route for a call, applying the short-input heuristic"""
+        if (
+            call_type == CALL_CONTEXTUAL
+            and user_input
+            and CALL_FAST in self.routes
+            and len(user_input.split()) <= self.fast_max_words
+        ):
+            return self.routes[CALL_FAST]
+        if call_type in self.routes:
+            return self.routes[call_type]
+        return Route(
+            self.default_provider, default_model(self.config, self.default_provider)
+        )
+
+    def estimate_cost(
+        self, call_type, system_message, user_message, max_tokens, user_input=None
+    ):
+        """Upper-bound dollar cost of a call before it is made"""
+        route = self.route(call_type, user_input)
+        input_price, _, output_price = model_pricing(route.provider, route.model)
+        return (
+            estimate_tokens(system_message + user_message) * input_price / 1000
+            + max_tokens * output_price / 1000
+        )
+
+    def providers(self):
+        """All providers referenced by any route"""
+        return sorted(
+            {route.provider for route in self.routes.values()} | {self.default_provider}
+        )
+
+    def get_client(self, provider):
+        """Return the SDK client for a provider, creating it on first use"""
+        client = self._clients.get(provider)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(provider)
+                if client is None:
+                    client = self._create_client(provider)
+                    self._clients[provider] = client
+        return client
+
+    def warm(self, provider):
+        """Create the provider's client and open a connection in its pool"""
+        import httpx
+
+        client = self.get_client(provider).with_options(timeout=10, max_retries=0)
+        # Any response will do; the point is to finish DNS and the TLS handshake
+        # before a player is waiting on it. Both SDKs support these custom
+        # requests, and raise for error statuses like a 401 or 404.
+        try:
+            return client.get("/models", cast_to=httpx.Response).status_code
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if status is None:
+                raise
+            return status
+
+    def get_limiter(self, provider):
+        """Return the admission controller guarding calls to a provider"""
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.setdefault(
+                    provider, controller_from_config(self.config, provider)
+                )
+        return limiter
+
+    def stats(self):
+        """Queue and concurrency metrics for every provider used so far"""
+        return {
+            provider: limiter.stats()
+            for provider, limiter in sorted(self._limiters.items())
+        }
+
+    def _create_client(self, provider):
+        # SDKs are imported here so only the providers actually routed to are loaded
+        if provider == "anthropic":
+            import anthropic
+
+            return anthropic.Anthropic(api_key=self.config.get("ANTHROPIC_API_KEY"))
+        from openai import OpenAI
+
+        return OpenAI(api_key=self.config.get("OPENAI_API_KEY"))
+
+    def complete(
+        self,
+        call_type,
+        system_message,
+        user_message,
+        max_tokens,
+        temperature,
+        user_input=None,
+        priority=PRIORITY_INTERACTIVE,
+        owner=None,
+    ):
+        """Run one chat completion on the routed provider and normalize the result
+
+        `owner` is the player's session id, so queued calls are shared fairly
+        between players. Raises ProviderBusy if the provider's queue can't
+        admit the call in time.
+        """
+        route = self.route(call_type, user_input)
+        client = self.get_client(route.provider)
+        limiter = self.get_limiter(route.provider)
+        reserved = estimate_tokens(system_message + user_message) + max_tokens
+        waited = limiter.acquire(reserved, priority, owner=owner)
+        print(
+            f"DEBUG: Routing {call_type} call to {route.provider}:{route.model} (queued {waited:.2f}s)"
+        )
+        started = time.monotonic()
+        result = None
+        try:
+            result = self._call(
+                route, client, system_message, user_message, max_tokens, temperature
+            )
+            return result
+        finally:
+            limiter.release(
+                reserved,
+                used_tokens=(
+                    result.input_tokens + result.output_tokens if result else None
+                ),
+                call_seconds=time.monotonic() - started,
+            )
+
+    def _call(
+        self, route, client, system_message, user_message, max_tokens, temperature
+    ):
+        if route.provider == "anthropic":
+            response = client.messages.create(
+                model=route.model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system_message,
+                messages=[{"role": "user", "content": user_message}],
+            )
+            usage = response.usage
+            # Anthropic reports cache reads separately from input_tokens
+            cached_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+            return ModelResponse(
+                response.content[0].text,
+                route.provider,
+                route.model,
+                input_tokens=usage.input_tokens + cached_tokens,
+                output_tokens=usage.output_tokens,
+                cached_tokens=cached_tokens,
+            )
+
+        response = client.chat.completions.create(
+            model=route.model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message},
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        usage = response.usage
+        # Check for cached tokens (available in newer API responses)
+        cached_tokens = 0
+        if hasattr(usage, "prompt_tokens_details") and usage.prompt_tokens_details:
+            cached_tokens = getattr(usage.prompt_tokens_details, "cached_tokens", 0)
+        return ModelResponse(
+            response.choices[0].message.content,
+            route.provider,
+            route.model,
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            cached_tokens=cached_tokens or 0,
+        )
@@ -0,0 +1,132 @@
+import json
+import threading
+from collections import namedtuple
+
+from provider_limits import estimate_tokens
+
+# One named piece of a prompt. `static` means the text is the same on every
+# call for the same story and scene, so providers can cache it.
+Section = namedtuple("Section", "name text static")
+
+
+def join_sections(sections):
+    return "".join(section.text for section in sections)
+
+
+def section_tokens(sections, input_tokens=None):
+    """Estimated tokens per section, scaled to the provider's input count if known"""
+    estimates = [estimate_tokens(section.text) for section in sections]
+    if input_tokens:
+        scale = input_tokens / max(1, sum(estimates))
+        estimates = [round(tokens * scale) for tokens in estimates]
+    return estimates
+
+
+class PromptAnatomy:
+    """Token totals per prompt section, per call type
+
+    Each call records the tokens of every section of its system and user
+    messages. A section is in the cacheable prefix when it and every section
+    before it are static, since providers only cache a shared prefix. If
+    `log_path` is set, each call is also appended there as a JSON line, so
+    reports can cover many sessions and processes.
+    """
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._totals = {}  # call_type -> {"calls": n, "sections": {name: {...}}}
+        self._lock = threading.Lock()
+
+    def record(self, call_type, system_sections, user_sections, input_tokens=None):
+        sections = list(system_sections) + list(user_sections)
+        tokens = section_tokens(sections, input_tokens)
+        entry = {"call_type": call_type, "sections": []}
+        prefix = True
+        for section, count in zip(sections, tokens):
+            prefix = prefix and section.static
+            entry["sections"].append(
+                {
+                    "name": section.name,
+                    "tokens": count,
+                    "static": section.static,
+                    "prefix": prefix,
+                }
+            )
+        with self._lock:
+            self._add(entry)
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def _add(self, entry):
+        totals = self._totals.setdefault(entry["call_type"], {"calls": 0})
+        totals["calls"] += 1
+        sections = totals.setdefault("sections", {})
+        for item in entry["sections"]:
+            section = sections.setdefault(
+                item["name"],
+                {"tokens": 0, "static": True, "prefix": True},
+            )
+            section["tokens"] += item["tokens"]
+            # A section only counts as static if it was static on every call
+            section["static"] = section["static"] and item["static"]
+            section["prefix"] = section["prefix"] and item["prefix"]
+
+    def load(self, path):
+        """Add the calls recorded in a log file; returns how many were read"""
+        count = 0
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    with self._lock:
+                        self._add(json.loads(line))
+                    count += 1
+        return count
+
+    def report(self):
+        """Per call type: calls, and per section total/average tokens and share"""
+        with self._lock:
+            report = {}
+            for call_type, totals in self._totals.items():
+                calls = totals["calls"]
+                total = sum(s["tokens"] for s in totals["sections"].values()) or 1
+                sections = {
+                    name: {
+                        "avg_tokens": round(section["tokens"] / calls, 1),
+                        "share": round(section["tokens"] / total, 3),
+                        "static": section["static"],
+                        "cacheable_prefix": section["prefix"],
+                    }
+                    for name, section in totals["sections"].items()
+                }
+                report[call_type] = {
+                    "calls": calls,
+                    "avg_input_tokens": round(total / calls, 1),
+                    "static_share": round(
+                        sum(s["share"] for s in sections.values() if s["static"]), 3
+                    ),
+                    "sections": sections,
+                }
+            return report
+
+
+def format_report(report):
+    lines = []
+    for call_type, data in sorted(report.items()):
+        lines.append(
+            f"{call_type}: {data['calls']} calls, {data['avg_input_tokens']} input tokens on average, {data['static_share']:.0%} static"
+        )
+        lines.append(f"  {'section':<22} {'avg tokens':>10} {'share':>6}  kind")
+        for name, section in sorted(
+            data["sections"].items(), key=lambda item: -item[1]["avg_tokens"]
+        ):
+            if section["cacheable_prefix"]:
+                kind = "static, cacheable prefix"
+            elif section["static"]:
+                kind = "static"
+            else:
+                kind = "dynamic"
+            lines.append(
+                f"  {name:<22} {section['avg_tokens']:>10} {section['share']:>6.0%}  {kind}"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,308 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from settings import setting
+
+# Interactive turns are admitted ahead of speculative or background work
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class ProviderBusy(Exception):
+    """Raised when a call cannot be admitted before its queue deadline"""
+
+    def __init__(self, provider, retry_after):
+        self.provider = provider
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__(
+            f"{provider} is at capacity, retry after {self.retry_after} seconds"
+        )
+
+
+class SlowDown(Exception):
+    """Raised when a player starts turns faster than their rate limit allows"""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__(f"Too many turns, retry after {self.retry_after} seconds")
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Tokens-per-minute budget refilled continuously
+
+    The bucket holds up to `capacity` tokens, a full minute's worth unless a
+    smaller burst is given.
+    """
+
+    def __init__(self, tokens_per_minute, capacity=None):
+        self.capacity = capacity or tokens_per_minute
+        self.tokens = float(self.capacity)
+        self.refill_rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.refill_rate
+        )
+        self.updated = now
+
+    def wait_time(self, tokens):
+        """Seconds until `tokens` are available (0 if they are available now)"""
+        self.refill()
+        # A single call larger than the bucket only has to wait for a full bucket
+        tokens = min(tokens, self.capacity)
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.refill_rate
+
+    def take(self, tokens):
+        self.refill()
+        self.tokens -= tokens
+
+    def give_back(self, tokens):
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+class PlayerRateLimiter:
+    """Per-session token buckets for turns: a burst, then a steady rate
+
+    Each session may start `burst` turns at once and `per_minute` turns a
+    minute after that; beyond it, `admit` raises SlowDown. Buckets that have
+    refilled completely are forgotten, since a new bucket is the same.
+    """
+
+    def __init__(self, burst=5, per_minute=12):
+        self.burst = burst
+        self.per_minute = per_minute
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.limited = 0
+
+    @property
+    def enabled(self):
+        return self.burst > 0 and self.per_minute > 0
+
+    def admit(self, sid):
+        if not self.enabled:
+            return
+        with self._lock:
+            bucket = self._buckets.get(sid)
+            if bucket is None:
+                if len(self._buckets) >= 10000:
+                    self._forget_full()
+                bucket = self._buckets[sid] = TokenBucket(self.per_minute, self.burst)
+            wait = bucket.wait_time(1)
+            if wait:
+                self.limited += 1
+                raise SlowDown(wait)
+            bucket.take(1)
+            self.admitted += 1
+
+    def _forget_full(self):
+        for sid, bucket in list(self._buckets.items()):
+            if bucket.wait_time(bucket.capacity) == 0:
+                del self._buckets[sid]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "burst": self.burst,
+                "per_minute": self.per_minute,
+                "admitted": self.admitted,
+                "limited": self.limited,
+                "tracked_sessions": len(self._buckets),
+            }
+
+
+class AdmissionController:
+    """Concurrency limit, token-rate limit and bounded priority queue for one provider
+
+    Within a priority, waiting calls are served round-robin across owners
+    (sessions) when `fair` is set: each call is tagged one round after its
+    owner's previous call, or after the current round if the owner has
+    nothing waiting. A session with many calls queued therefore gets one
+    call in per round, and a player arriving later is served in the next
+    round instead of behind the whole backlog.
+    """
+
+    def __init__(
+        self,
+        provider,
+        max_concurrent=8,
+        tokens_per_minute=0,
+        max_queue=32,
+        queue_timeout=20.0,
+        fair=True,
+    ):
+        self.provider = provider
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.fair = fair
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.in_flight = 0
+        self._waiting = []  # heap of (priority, round, sequence)
+        self._evicted = set()  # entries dropped from a full queue for higher priority
+        self._sequence = itertools.count()
+        self._round = 0  # round of the call admitted last
+        self._owner_rounds = {}  # owner -> round of their latest queued call
+        self._cond = threading.Condition()
+        # Moving average of call duration, used to predict queue wait
+        self._avg_call_seconds = 5.0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _predicted_wait(self, position, tokens):
+        """Estimate how long a caller at `position` in the queue would wait"""
+        slot_wait = 0.0
+        if self.in_flight + position >= self.max_concurrent:
+            rounds = (self.in_flight + position - self.max_concurrent) // max(
+                1, self.max_concurrent
+            ) + 1
+            slot_wait = rounds * self._avg_call_seconds
+        token_wait = self.bucket.wait_time(tokens) if self.bucket else 0.0
+        return max(slot_wait, token_wait)
+
+    def _can_run(self, entry, tokens):
+        return (
+            self._waiting
+            and self._waiting[0] == entry
+            and self.in_flight < self.max_concurrent
+            and (not self.bucket or self.bucket.wait_time(tokens) == 0)
+        )
+
+    def _next_round(self, owner):
+        if not self.fair:
+            return 0
+        # Owners not seen recently are at or behind the current round
+        if len(self._owner_rounds) > 4 * self.max_queue:
+            self._owner_rounds = {
+                key: value
+                for key, value in self._owner_rounds.items()
+                if value > self._round
+            }
+        return max(self._round, self._owner_rounds.get(owner, 0)) + 1
+
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE, timeout=None, owner=None):
+        """Block until the call may run; raise ProviderBusy if the deadline would pass
+
+        `owner` identifies the session the call is for, for fair queuing.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            entry = (priority, self._next_round(owner), next(self._sequence))
+            position = sum(1 for waiting in self._waiting if waiting < entry)
+            predicted = self._predicted_wait(position, tokens)
+            if predicted > timeout:
+                self.rejected += 1
+                raise ProviderBusy(self.provider, predicted)
+            if len(self._waiting) >= self.max_queue:
+                # A queue full of background calls mustn't turn players away:
+                # make room by dropping the last waiter if it ranks lower
+                last = max(self._waiting, default=None)
+                if last is None or last[0] <= priority:
+                    self.rejected += 1
+                    raise ProviderBusy(
+                        self.provider, self._predicted_wait(len(self._waiting), tokens)
+                    )
+                self._waiting.remove(last)
+                heapq.heapify(self._waiting)
+                self._evicted.add(last)
+                self._cond.notify_all()
+
+            heapq.heappush(self._waiting, entry)
+            if self.fair:
+                self._owner_rounds[owner] = entry[1]
+            try:
+                while not self._can_run(entry, tokens):
+                    remaining = deadline - time.monotonic()
+                    if entry in self._evicted or remaining <= 0:
+                        self.rejected += 1
+                        raise ProviderBusy(
+                            self.provider, self._predicted_wait(position, tokens)
+                        )
+                    token_wait = self.bucket.wait_time(tokens) if self.bucket else 0
+                    self._cond.wait(min(remaining, token_wait or remaining))
+            finally:
+                if entry in self._evicted:
+                    self._evicted.discard(entry)
+                else:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                # Let the next waiter re-check now that the head has changed
+                self._cond.notify_all()
+
+            self.in_flight += 1
+            self._round = max(self._round, entry[1])
+            if self.bucket:
+                self.bucket.take(tokens)
+            waited = time.monotonic() - start
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def release(self, reserved_tokens, used_tokens=None, call_seconds=None):
+        """Free the slot and refund any reserved tokens the call didn't use"""
+        with self._cond:
+            self.in_flight -= 1
+            if (
+                self.bucket
+                and used_tokens is not None
+                and used_tokens < reserved_tokens
+            ):
+                self.bucket.give_back(reserved_tokens - used_tokens)
+            if call_seconds is not None:
+                self._avg_call_seconds = (
+                    0.8 * self._avg_call_seconds + 0.2 * call_seconds
+                )
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._waiting),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_queue_seconds": (
+                    round(self.total_wait / self.admitted, 3) if self.admitted else 0.0
+                ),
+                "max_queue_seconds": round(self.max_wait, 3),
+                "avg_call_seconds": round(self._avg_call_seconds, 3),
+            }
+
+
+def _limit_setting(config, provider, name, default):
+    """Read <PROVIDER>_<NAME>, then PROVIDER_<NAME>, then the default"""
+    return setting(
+        config,
+        f"{provider.upper()}_{name}",
+        setting(config, f"PROVIDER_{name}", default),
+    )
+
+
+def controller_from_config(config, provider):
+    return AdmissionController(
+        provider,
+        max_concurrent=_limit_setting(config, provider, "MAX_CONCURRENT", 8),
+        tokens_per_minute=_limit_setting(config, provider, "TOKENS_PER_MINUTE", 0),
+        max_queue=_limit_setting(config, provider, "MAX_QUEUE", 32),
+        queue_timeout=_limit_setting(config, provider, "QUEUE_TIMEOUT", 20.0),
+        fair=_limit_setting(config, provider, "FAIR_QUEUE", True),
+    )
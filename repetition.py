@@ -0,0 +1,125 @@
+import re
+import zlib
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+# Sentence ends, allowing a closing quote after the punctuation
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|(?<=[.!?][\"'”])\s+")
+# The same split, keeping the whitespace between sentences
+SENTENCE_GAP_RE = re.compile(r"((?<=[.!?])\s+|(?<=[.!?][\"'”])\s+)")
+
+
+def split_sentences(paragraph):
+    return [part for part in SENTENCE_END_RE.split(paragraph) if part.strip()]
+
+
+class RepetitionGuard:
+    """Detect passages that re-describe what the player has already read
+
+    Text is reduced to hashed word n-grams (shingles). Only shingles whose
+    hash is divisible by `sample` are kept, which keeps the per-session index
+    small enough to store with the session while still covering every
+    sentence of useful length. A sentence of a new reply counts as repeated
+    when at least `threshold` of its sampled shingles were seen before.
+
+    `action` decides what happens to repeated sentences: "measure" only
+    counts them, "trim" drops them, "rewrite" asks the model for one targeted
+    rewrite (trimming if that fails) and "off" disables the check.
+    """
+
+    def __init__(self, ngram=5, threshold=0.5, sample=2, action="measure"):
+        self.ngram = ngram
+        self.threshold = threshold
+        self.sample = sample
+        self.action = action
+        self.checked = 0
+        self.repeated = 0
+        self.flagged_sentences = 0
+        self.trimmed_sentences = 0
+        self.rewrites = 0
+
+    @property
+    def enabled(self):
+        return self.action != "off"
+
+    @property
+    def edits(self):
+        return self.action in ("trim", "rewrite")
+
+    def scene_fingerprint(self, text):
+        """Shingles of scene text to store with the session
+
+        Only kept when replies are edited; measuring compares replies with
+        the earlier replies alone, so the session stays compact.
+        """
+        return self.fingerprint(text) if self.edits else set()
+
+    def fingerprint(self, text):
+        """Sampled shingle hashes of text"""
+        words = WORD_RE.findall(text.lower())
+        hashes = set()
+        for i in range(len(words) - self.ngram + 1):
+            value = zlib.crc32(" ".join(words[i : i + self.ngram]).encode("utf-8"))
+            if value % self.sample == 0:
+                hashes.add(value)
+        return hashes
+
+    def index(self, seen, texts=()):
+        """Index of stored shingles plus those of `texts`"""
+        index = set(seen)
+        for text in texts:
+            index |= self.fingerprint(text)
+        return index
+
+    def repeated_sentences(self, index, content):
+        repeated = []
+        for paragraph in content.split("\n\n"):
+            for sentence in split_sentences(paragraph):
+                hashes = self.fingerprint(sentence)
+                if hashes and len(hashes & index) / len(hashes) >= self.threshold:
+                    repeated.append(sentence)
+        return repeated
+
+    def check(self, index, content):
+        """Repeated sentences in content, counted in the stats"""
+        self.checked += 1
+        repeated = self.repeated_sentences(index, content)
+        if repeated:
+            self.repeated += 1
+            self.flagged_sentences += len(repeated)
+        return repeated
+
+    def trim(self, content, repeated):
+        """Drop repeated sentences, keeping the whitespace between the others
+
+        Returns the content unchanged if nothing would be left.
+        """
+        drop = set(repeated)
+        paragraphs = []
+        for paragraph in content.split("\n\n"):
+            parts = SENTENCE_GAP_RE.split(paragraph)  # sentence, gap, sentence...
+            kept = ""
+            gap = None  # the gap after the last kept sentence
+            for i in range(0, len(parts), 2):
+                if i and gap is None:
+                    gap = parts[i - 1]
+                sentence = parts[i]
+                if not sentence.strip() or sentence in drop:
+                    continue
+                kept += (gap if kept else "") + sentence
+                gap = None
+            if kept:
+                paragraphs.append(kept)
+        if not paragraphs:
+            return content
+        self.trimmed_sentences += len(drop)
+        return "\n\n".join(paragraphs)
+
+    def stats(self):
+        return {
+            "action": self.action,
+            "checked": self.checked,
+            "repeated": self.repeated,
+            "flagged_sentences": self.flagged_sentences,
+            "trimmed_sentences": self.trimmed_sentences,
+            "rewrites": self.rewrites,
+        }
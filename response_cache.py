@@ -0,0 +1,68 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+def state_fingerprint(*sections):
+    """Stable hash of the state-dependent parts of a prompt"""
+    encoded = json.dumps(sections, sort_keys=True, default=sorted)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Bounded LRU of response variants with a time-to-live
+
+    Each key holds a pool of up to `variants` responses. A key only serves hits
+    once its pool is full, so players still see some variety.
+    """
+
+    def __init__(self, max_entries=512, ttl=86400, variants=3):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = variants
+        self._entries = OrderedDict()  # key -> (created, [responses])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return a random cached variant, or None if the pool isn't ready"""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None or len(entry[1]) < self.variants:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry[1])
+
+    def add(self, key, response):
+        """Add a freshly generated variant to the key's pool"""
+        if not self.max_entries:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                entry = (time.time(), [])
+                self._entries[key] = entry
+            if len(entry[1]) < self.variants and response not in entry[1]:
+                entry[1].append(response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import threading
+import time
+
+
+class SceneCache:
+    """Generated scene expansions, persisted as one JSON file per scene
+
+    A scene expansion depends only on the static story data in its prompt, so
+    variants can be shared by every player. Each file records a hash of the
+    prompt it was generated from; variants from an older prompt are ignored.
+    Like ResponseCache, a scene is only served from cache once it holds
+    `variants` entries.
+    """
+
+    def __init__(self, directory, variants=3):
+        self.directory = directory
+        self.variants = variants
+        self._scenes = {}  # (story_index, scene) -> {"prompt_hash", "variants"}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.variants > 0
+
+    def _path(self, story_index, scene):
+        return os.path.join(self.directory, f"story{story_index + 1}_{scene}.json")
+
+    def _read(self, story_index, scene):
+        """Return the scene's entry, reading it from disk on first use"""
+        key = (story_index, scene)
+        entry = self._scenes.get(key)
+        if entry is None:
+            entry = {"prompt_hash": None, "variants": []}
+            try:
+                with open(self._path(story_index, scene)) as f:
+                    entry = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"Warning: Ignoring unreadable scene cache file: {e}")
+            self._scenes[key] = entry
+        return entry
+
+    def load_all(self):
+        """Read every cached scene into memory; returns the number of variants"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return 0
+        count = 0
+        with self._lock:
+            for name in sorted(os.listdir(self.directory)):
+                if not (name.startswith("story") and name.endswith(".json")):
+                    continue
+                try:
+                    story, scene = name[len("story") : -len(".json")].split("_")
+                    entry = self._read(int(story) - 1, int(scene))
+                except ValueError:
+                    continue
+                count += len(entry["variants"])
+        return count
+
+    def count(self, story_index, scene, prompt_hash):
+        """Number of usable variants stored for a scene"""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            entry = self._read(story_index, scene)
+            if entry["prompt_hash"] != prompt_hash:
+                return 0
+            return len(entry["variants"])
+
+    def get(self, story_index, scene, prompt_hash):
+        """Return a random cached expansion, or None if the pool isn't ready"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._read(story_index, scene)
+            if (
+                entry["prompt_hash"] != prompt_hash
+                or len(entry["variants"]) < self.variants
+            ):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return random.choice(entry["variants"])["content"]
+
+    def add(self, story_index, scene, prompt_hash, content, **details):
+        """Store a new expansion (with optional model and usage details)"""
+        if not self.enabled or not content:
+            return
+        with self._lock:
+            entry = self._read(story_index, scene)
+            if entry["prompt_hash"] != prompt_hash:
+                entry = {"prompt_hash": prompt_hash, "variants": []}
+                self._scenes[(story_index, scene)] = entry
+            if len(entry["variants"]) >= self.variants:
+                return
+            entry["variants"].append(
+                dict(details, content=content, created=int(time.time()))
+            )
+            self._write(story_index, scene, entry)
+
+    def _write(self, story_index, scene, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(story_index, scene)
+        # Write to a temporary file first so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scenes": len(self._scenes),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
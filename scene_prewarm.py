@@ -0,0 +1,350 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app import AdventureBot, finish_text
+from model_router import CALL_SCENE, ModelResponse
+from provider_limits import PRIORITY_BACKGROUND, estimate_tokens
+from response_cache import state_fingerprint
+from scene_cache import SceneCache
+
+# Same settings generate_scene_content uses, so cached variants match live ones
+SCENE_MAX_TOKENS = 1000
+SCENE_TEMPERATURE = 0.5
+
+# Both providers bill batch requests at half the normal price
+BATCH_PRICE_FACTOR = 0.5
+
+
+def scene_requests(runtime, variants):
+    """One request per scene variant the cache is still missing"""
+    bot = AdventureBot(runtime, {}, "prewarm")
+    requests = []
+    for story_index, story in enumerate(bot.story_arcs):
+        bot.current_story = story
+        bot.canonical_facts = story.get("canonical_facts", [])
+        for scene, outline in enumerate(story["scenes"], 1):
+            bot.current_scene = scene
+            system_message, user_message = bot.build_scene_prompt(outline)
+            prompt_hash = state_fingerprint(system_message, user_message)
+            have = runtime.scene_cache.count(story_index, scene, prompt_hash)
+            for variant in range(have, variants):
+                requests.append(
+                    {
+                        # Batch APIs only accept [a-zA-Z0-9_-] in ids
+                        "custom_id": f"story{story_index + 1}-scene{scene}-v{variant}-{prompt_hash[:12]}",
+                        "story_index": story_index,
+                        "scene": scene,
+                        "prompt_hash": prompt_hash,
+                        "system": system_message,
+                        "user": user_message,
+                    }
+                )
+    return requests
+
+
+class OpenAIBatch:
+    name = "openai"
+    price_factor = BATCH_PRICE_FACTOR
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    def submit(self, requests):
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": request["custom_id"],
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.model,
+                        "messages": [
+                            {"role": "system", "content": request["system"]},
+                            {"role": "user", "content": request["user"]},
+                        ],
+                        "max_tokens": SCENE_MAX_TOKENS,
+                        "temperature": SCENE_TEMPERATURE,
+                    },
+                }
+            )
+            for request in requests
+        ]
+        upload = self.client.files.create(
+            file=("scene_prewarm.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def finished(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            print(f"Warning: Batch {batch_id} ended with status {batch.status}")
+            return True
+        return batch.status == "completed"
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                print(f"Warning: {item['custom_id']} failed: {item.get('error')}")
+                continue
+            body = response["body"]
+            usage = body["usage"]
+            cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            yield item["custom_id"], ModelResponse(
+                body["choices"][0]["message"]["content"],
+                "openai",
+                body.get("model", self.model),
+                input_tokens=usage["prompt_tokens"],
+                output_tokens=usage["completion_tokens"],
+                cached_tokens=cached or 0,
+            )
+
+
+class AnthropicBatch:
+    name = "anthropic"
+    price_factor = BATCH_PRICE_FACTOR
+
+    def __init__(self, client, model):
+        # Older SDKs only expose Message Batches under beta
+        self.batches = getattr(client.messages, "batches", None)
+        if self.batches is None:
+            self.batches = client.beta.messages.batches
+        self.model = model
+
+    def submit(self, requests):
+        batch = self.batches.create(
+            requests=[
+                {
+                    "custom_id": request["custom_id"],
+                    "params": {
+                        "model": self.model,
+                        "max_tokens": SCENE_MAX_TOKENS,
+                        "temperature": SCENE_TEMPERATURE,
+                        "system": request["system"],
+                        "messages": [{"role": "user", "content": request["user"]}],
+                    },
+                }
+                for request in requests
+            ]
+        )
+        return batch.id
+
+    def finished(self, batch_id):
+        return self.batches.retrieve(batch_id).processing_status == "ended"
+
+    def results(self, batch_id):
+        for item in self.batches.results(batch_id):
+            if item.result.type != "succeeded":
+                print(f"Warning: {item.custom_id} failed: {item.result.type}")
+                continue
+            message = item.result.message
+            cached = getattr(message.usage, "cache_read_input_tokens", 0) or 0
+            yield item.custom_id, ModelResponse(
+                message.content[0].text,
+                "anthropic",
+                message.model,
+                input_tokens=message.usage.input_tokens + cached,
+                output_tokens=message.usage.output_tokens,
+                cached_tokens=cached,
+            )
+
+
+class LocalBatch:
+    """Stand-in for a provider batch API, for trying pre-warm without spending
+
+    Its output is placeholder text, so ScenePrewarm writes it to a scratch
+    directory, never to the cache players are served from.
+    """
+
+    name = "local"
+    price_factor = 0.0
+
+    def __init__(self):
+        self._batches = {}
+
+    def submit(self, requests):
+        batch_id = f"local-{len(self._batches) + 1}"
+        self._batches[batch_id] = list(requests)
+        return batch_id
+
+    def finished(self, batch_id):
+        return True
+
+    def results(self, batch_id):
+        for request in self._batches.pop(batch_id, []):
+            content = f"[Stand-in scene]\n\n{request['user']}"
+            yield request["custom_id"], ModelResponse(
+                content,
+                "local",
+                "local-stand-in",
+                input_tokens=estimate_tokens(request["system"] + request["user"]),
+                output_tokens=estimate_tokens(content),
+            )
+
+
+class ScenePrewarm:
+    """Fill the scene cache with `variants` expansions of every story scene
+
+    Each finished variant is written to the cache as soon as it arrives, and
+    a submitted batch's id is saved next to the cache, so an interrupted run
+    picks up where it stopped: it collects the pending batch instead of
+    paying for it again, then requests only the variants still missing.
+    """
+
+    def __init__(self, runtime, variants, mode="auto", parallel=4, poll_seconds=30):
+        self.runtime = runtime
+        if mode == "local":
+            runtime.scene_cache = SceneCache(
+                tempfile.mkdtemp(prefix="scene_cache_local_"),
+                runtime.scene_cache.variants,
+            )
+            print(f"Writing stand-in scenes to {runtime.scene_cache.directory}")
+        self.cache = runtime.scene_cache
+        # The cache only stores up to its own variant count
+        self.cache.variants = max(self.cache.variants, variants)
+        self.variants = variants
+        self.mode = mode
+        self.parallel = parallel
+        self.poll_seconds = poll_seconds
+        self.state_path = os.path.join(self.cache.directory, "prewarm_batch.json")
+        self.totals = {"variants": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0}
+
+    def batch_backend(self):
+        if self.mode == "local":
+            return LocalBatch()
+        route = self.runtime.model_router.route(CALL_SCENE)
+        client = self.runtime.model_router.get_client(route.provider)
+        if route.provider == "anthropic":
+            return AnthropicBatch(client, route.model)
+        return OpenAIBatch(client, route.model)
+
+    def run(self):
+        if not self.cache.enabled:
+            raise ValueError("The scene cache is disabled (set SCENE_CACHE_DIR)")
+        self.resume()
+        requests = scene_requests(self.runtime, self.variants)
+        print(f"Pre-warming {len(requests)} scene variants")
+        if requests:
+            if self.mode == "concurrent":
+                self.run_concurrent(requests)
+            else:
+                backend = self.batch_backend()
+                try:
+                    batch_id = backend.submit(requests)
+                except Exception as e:
+                    if self.mode != "auto":
+                        raise
+                    print(f"Batch API unavailable ({e}), generating concurrently")
+                    self.run_concurrent(requests)
+                else:
+                    self.run_batch(backend, batch_id, requests)
+        return self.totals
+
+    def resume(self):
+        """Collect a batch submitted by an earlier, interrupted run"""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        print(f"Resuming batch {state['batch_id']}")
+        backend = self.batch_backend()
+        if backend.name != state["backend"]:
+            print(
+                f"Warning: Batch {state['batch_id']} was sent to {state['backend']}, skipping it"
+            )
+        else:
+            self.collect(backend, state["batch_id"], state["requests"])
+        os.remove(self.state_path)
+
+    def run_batch(self, backend, batch_id, requests):
+        print(f"Submitted batch {batch_id} to {backend.name}")
+        index = {
+            request["custom_id"]: [
+                request["story_index"],
+                request["scene"],
+                request["prompt_hash"],
+            ]
+            for request in requests
+        }
+        os.makedirs(self.cache.directory, exist_ok=True)
+        with open(self.state_path, "w") as f:
+            json.dump(
+                {"backend": backend.name, "batch_id": batch_id, "requests": index}, f
+            )
+        self.collect(backend, batch_id, index)
+        os.remove(self.state_path)
+
+    def collect(self, backend, batch_id, index):
+        while not backend.finished(batch_id):
+            time.sleep(self.poll_seconds)
+        for custom_id, result in backend.results(batch_id):
+            if custom_id in index:
+                story_index, scene, prompt_hash = index[custom_id]
+                self.store(
+                    story_index, scene, prompt_hash, result, backend.price_factor
+                )
+
+    def run_concurrent(self, requests):
+        router = self.runtime.model_router
+
+        def generate(request):
+            return router.complete(
+                CALL_SCENE,
+                request["system"],
+                request["user"],
+                max_tokens=SCENE_MAX_TOKENS,
+                temperature=SCENE_TEMPERATURE,
+                priority=PRIORITY_BACKGROUND,
+            )
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            futures = {
+                executor.submit(generate, request): request for request in requests
+            }
+            for future in as_completed(futures):
+                request = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Warning: {request['custom_id']} failed: {e}")
+                    continue
+                self.store(
+                    request["story_index"],
+                    request["scene"],
+                    request["prompt_hash"],
+                    result,
+                    1.0,
+                )
+
+    def store(self, story_index, scene, prompt_hash, result, price_factor):
+        cost = result.cost * price_factor if price_factor else 0.0
+        self.cache.add(
+            story_index,
+            scene,
+            prompt_hash,
+            finish_text(result.content),
+            model=result.model,
+            input_tokens=result.input_tokens,
+            output_tokens=result.output_tokens,
+            cost=round(cost, 6),
+        )
+        self.totals["variants"] += 1
+        self.totals["input_tokens"] += result.input_tokens
+        self.totals["output_tokens"] += result.output_tokens
+        self.totals["cost"] += cost
+        print(f"✓ Cached story {story_index + 1} scene {scene}")
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class SessionSweeper:
+    """Remove abandoned session files from the filesystem session store
+
+    Session files are rewritten on every turn, so a file's modification time is
+    the player's last activity. Files idle for longer than `ttl` seconds are
+    deleted; if the store is still over `max_bytes` or `max_files`, the least
+    recently used files go next. Sweeps only touch the filesystem and never
+    take locks shared with request handling.
+    """
+
+    def __init__(
+        self, directory, ttl=7 * 86400, max_bytes=0, max_files=0, interval=3600
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.interval = interval
+        self.last_report = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_file():
+                            continue
+                        info = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((info.st_mtime, info.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sweep(self, now=None):
+        """Delete expired and excess session files; returns a report dict"""
+        started = time.monotonic()
+        now = now or time.time()
+        entries = self._scan()
+        report = {
+            "scanned": len(entries),
+            "expired": 0,
+            "evicted": 0,
+            "reclaimed_bytes": 0,
+        }
+
+        live = []
+        for mtime, size, path in entries:
+            if self.ttl and now - mtime > self.ttl:
+                if self._remove(path):
+                    report["expired"] += 1
+                    report["reclaimed_bytes"] += size
+            else:
+                live.append((mtime, size, path))
+
+        # Least recently used first
+        live.sort()
+        total_bytes = sum(size for _, size, _ in live)
+        while live and (
+            (self.max_bytes and total_bytes > self.max_bytes)
+            or (self.max_files and len(live) > self.max_files)
+        ):
+            _, size, path = live.pop(0)
+            total_bytes -= size
+            if self._remove(path):
+                report["evicted"] += 1
+                report["reclaimed_bytes"] += size
+
+        report["remaining_files"] = len(live)
+        report["remaining_bytes"] = total_bytes
+        report["seconds"] = round(time.monotonic() - started, 3)
+        self.last_report = report
+        return report
+
+    def sweep_exclusive(self, wait=False):
+        """Sweep unless another process is already sweeping the same directory
+
+        With `wait`, wait for that sweep to finish and then sweep.
+        """
+        if fcntl is None:
+            return self.sweep()
+        lock_path = os.path.abspath(self.directory).rstrip(os.sep) + ".sweep.lock"
+        with open(lock_path, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except OSError:
+                return None
+            try:
+                return self.sweep()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def start(self):
+        """Sweep every `interval` seconds on a daemon thread in this process"""
+        with self._lock:
+            if not self.interval or self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._loop, name="session-sweeper", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            try:
+                report = self.sweep_exclusive()
+                if report and (report["expired"] or report["evicted"]):
+                    print(
+                        f"Session sweep: removed {report['expired']} expired and {report['evicted']} evicted sessions, reclaimed {report['reclaimed_bytes']} bytes"
+                    )
+            except Exception as e:
+                print(f"Session sweep failed: {e}")
+            time.sleep(self.interval)
@@ -0,0 +1,49 @@
+import json
+import os
+
+from dotenv import dotenv_values, load_dotenv
+
+
+def load_config(path=None, overrides=None):
+    """Collect settings from the environment, an optional file and overrides
+
+    Later sources win. Files ending in .json are read as a JSON object; any
+    other file is read as KEY=value lines like .env. The file can also be given
+    with the CLIFFHANGER_CONFIG environment variable.
+    """
+    # Load environment variables from .env file
+    load_dotenv()
+    config = dict(os.environ)
+
+    path = path or os.getenv("CLIFFHANGER_CONFIG")
+    if path:
+        if path.endswith(".json"):
+            with open(path) as f:
+                values = json.load(f)
+        else:
+            values = dotenv_values(path)
+        config.update({k: str(v) for k, v in values.items() if v is not None})
+        print(f"Loaded configuration from {path}")
+
+    if overrides:
+        config.update({k: str(v) for k, v in overrides.items() if v is not None})
+    return config
+
+
+def setting(config, name, default):
+    """Look up a setting and convert it to the type of `default`
+
+    Values that already have that type, as create_app() overrides and JSON
+    config files can give, are returned unchanged; anything else is parsed
+    from its string form.
+    """
+    value = config.get(name)
+    if value is None or value == "":
+        return default
+    kind = type(default)
+    if type(value) is kind:
+        return value
+    value = str(value).strip()
+    if kind is bool:
+        return value.lower() in ("1", "true", "yes", "on")
+    return kind(value)
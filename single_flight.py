@@ -0,0 +1,69 @@
+import re
+import threading
+import time
+
+
+def normalize_input(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    if not text:
+        return ""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(".!?")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """Coalesce identical in-flight work so only the first caller runs it
+
+    Callers with the same key that arrive while the first call is running (or
+    within `linger` seconds after it finished) receive the first call's result.
+    """
+
+    def __init__(self, linger=2.0):
+        self.linger = linger
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def _expire(self, now):
+        for key, call in list(self._calls.items()):
+            if call.finished_at is not None and now - call.finished_at > self.linger:
+                del self._calls[key]
+
+    def do(self, key, fn):
+        """Run fn() once per key; returns (result, shared)"""
+        with self._lock:
+            self._expire(time.monotonic())
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            print(f"DEBUG: Coalesced duplicate request for {key[1:]}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                # Failed calls are not shared with later arrivals
+                self._calls.pop(key, None)
+            raise
+        finally:
+            call.finished_at = time.monotonic()
+            call.done.set()
+        return call.result, False
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+
+from single_flight import normalize_input
+
+
+class CostBudget:
+    """Rolling one-hour spending cap for speculative calls"""
+
+    def __init__(self, max_cost_per_hour):
+        self.max_cost_per_hour = max_cost_per_hour
+        self._spent = []  # (timestamp, dollars)
+        self._lock = threading.Lock()
+
+    def _window_total(self, now):
+        self._spent = [(t, c) for t, c in self._spent if now - t < 3600]
+        return sum(c for _, c in self._spent)
+
+    def reserve(self, estimated_cost):
+        """Record an estimated cost if it fits under the cap"""
+        with self._lock:
+            now = time.time()
+            if self._window_total(now) + estimated_cost > self.max_cost_per_hour:
+                return False
+            self._spent.append((now, estimated_cost))
+            return True
+
+    def adjust(self, difference):
+        """Correct the window once the real cost of a call is known"""
+        with self._lock:
+            self._spent.append((time.time(), difference))
+
+    def spent(self):
+        with self._lock:
+            return self._window_total(time.time())
+
+
+class _Speculation:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.futures = {}  # normalized choice -> Future[ModelResponse]
+
+
+class Speculator:
+    """Generate replies to a scene's choices before the player picks one
+
+    At most one speculation is kept per session. It is consumed by the player's
+    next input: served if the input closely matches a choice and the story state
+    hasn't changed since it was generated, otherwise dropped.
+    """
+
+    def __init__(
+        self,
+        max_cost_per_hour=1.0,
+        match_threshold=0.75,
+        wait_timeout=30.0,
+        max_sessions=1000,
+        workers=2,
+    ):
+        self.budget = CostBudget(max_cost_per_hour)
+        self.match_threshold = match_threshold
+        self.wait_timeout = wait_timeout
+        self.max_sessions = max_sessions
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="speculation"
+        )
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.started = 0
+        self.skipped_for_budget = 0
+        self.served = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return self.budget.max_cost_per_hour > 0
+
+    def start(self, sid, fingerprint, choices, generate, estimate_cost):
+        """Begin generating a reply for each choice in the background
+
+        `generate(choice)` returns a ModelResponse and `estimate_cost(choice)`
+        returns the expected dollar cost used against the budget.
+        """
+        self.discard(sid)
+        if not self.enabled:
+            return
+        speculation = _Speculation(fingerprint)
+        for choice in choices:
+            key = normalize_input(choice)
+            if not key or key in speculation.futures:
+                continue
+            estimated = estimate_cost(choice)
+            if not self.budget.reserve(estimated):
+                self.skipped_for_budget += 1
+                print(f"DEBUG: Speculation budget reached, skipping '{choice}'")
+                continue
+            future = self._executor.submit(self._run, generate, choice, estimated)
+            future.estimated_cost = estimated
+            speculation.futures[key] = future
+            self.started += 1
+        if not speculation.futures:
+            return
+        with self._lock:
+            self._sessions[sid] = speculation
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self._cancel(evicted)
+
+    def _run(self, generate, choice, estimated):
+        try:
+            result = generate(choice)
+        except Exception:
+            self.budget.adjust(-estimated)
+            raise
+        self.budget.adjust(result.cost - estimated)
+        print(f"DEBUG: Speculative reply ready for '{choice}'")
+        return result
+
+    def _cancel(self, speculation):
+        for future in speculation.futures.values():
+            # Calls that never started don't count against the budget
+            if future.cancel():
+                self.budget.adjust(-future.estimated_cost)
+
+    def discard(self, sid):
+        with self._lock:
+            speculation = self._sessions.pop(sid, None)
+        if speculation:
+            self._cancel(speculation)
+
+    def take(self, sid, fingerprint, user_input):
+        """Return the speculative reply matching user_input, or None
+
+        The session's speculation is consumed either way.
+        """
+        with self._lock:
+            speculation = self._sessions.pop(sid, None)
+        if speculation is None:
+            return None
+        if speculation.fingerprint != fingerprint:
+            self._cancel(speculation)
+            self.dropped += 1
+            return None
+
+        typed = normalize_input(user_input)
+        best_choice, best_ratio = None, 0.0
+        for choice in speculation.futures:
+            ratio = SequenceMatcher(None, typed, choice).ratio()
+            if ratio > best_ratio:
+                best_choice, best_ratio = choice, ratio
+        if best_ratio < self.match_threshold:
+            self._cancel(speculation)
+            self.dropped += 1
+            return None
+
+        future = speculation.futures.pop(best_choice)
+        self._cancel(speculation)
+        try:
+            result = future.result(timeout=self.wait_timeout)
+        except Exception as e:
+            print(f"DEBUG: Speculative reply unavailable: {e}")
+            self.dropped += 1
+            return None
+        self.served += 1
+        print(
+            f"DEBUG: Serving speculative reply for '{best_choice}' ({best_ratio:.2f})"
+        )
+        return result.content
+
+    def stats(self):
+        return {
+            "started": self.started,
+            "served": self.served,
+            "dropped": self.dropped,
+            "skipped_for_budget": self.skipped_for_budget,
+            "spent_last_hour": round(self.budget.spent(), 4),
+        }
@@ -0,0 +1,91 @@
+import json
+import sys
+import zlib
+from types import MappingProxyType
+
+# Bumped whenever the encoded layout changes
+STATE_FORMAT = 2
+
+
+def freeze(value):
+    """Read-only copy of story data: mappings become proxies, lists tuples,
+    and strings are interned so every request shares one copy"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class SessionState:
+    """One player's game state in a compact form
+
+    History entries are (user, response) tuples and described elements are
+    integer ids into the codec's label table. The story itself is referenced
+    by its index in the shared arc registry, so canonical facts and scene
+    text are never copied into a session.
+    """
+
+    __slots__ = ("story_index", "scene", "history", "elements", "facts", "seen")
+
+    def __init__(
+        self, story_index, scene=0, history=(), elements=(), facts=(), seen=()
+    ):
+        self.story_index = story_index
+        self.scene = scene
+        self.history = list(history)
+        self.elements = frozenset(elements)
+        self.facts = list(facts)
+        # Sampled shingle hashes of the scene text shown to the player
+        self.seen = frozenset(seen)
+
+
+class StateCodec:
+    """Encode SessionState as compressed JSON bytes for the session store
+
+    `labels` is the table of known described-element labels. Ids are
+    positions in the table, so new labels must only ever be appended; labels
+    that aren't in the table are stored as text.
+    """
+
+    def __init__(self, labels, level=6):
+        self.labels = tuple(sys.intern(label) for label in labels)
+        self._ids = {label: i for i, label in enumerate(self.labels)}
+        self.level = level
+
+    def element_ids(self, labels):
+        return frozenset(self._ids.get(label, label) for label in labels)
+
+    def element_labels(self, ids):
+        return {self.labels[item] if isinstance(item, int) else item for item in ids}
+
+    def encode(self, state):
+        data = [
+            STATE_FORMAT,
+            state.story_index,
+            state.scene,
+            [list(entry) for entry in state.history],
+            sorted(state.elements, key=lambda item: (isinstance(item, str), item)),
+            state.facts,
+            sorted(state.seen),
+        ]
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        return zlib.compress(text.encode("utf-8"), self.level)
+
+    def decode(self, blob):
+        data = json.loads(zlib.decompress(blob).decode("utf-8"))
+        if data[0] == 1:
+            data.append([])  # format 1 had no seen shingles
+        elif data[0] != STATE_FORMAT:
+            raise ValueError(f"Unsupported session state format {data[0]}")
+        _, story_index, scene, history, elements, facts, seen = data
+        return SessionState(
+            story_index,
+            scene,
+            [tuple(entry) for entry in history],
+            elements,
+            facts,
+            seen,
+        )
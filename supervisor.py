@@ -0,0 +1,453 @@
+import bisect
+import hashlib
+import http.client
+import itertools
+import json
+import multiprocessing
+import signal
+import socket
+import sys
+import threading
+import time
+from http.cookies import CookieError, SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Headers that describe one connection, not the request, and aren't forwarded
+HOP_BY_HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes
+
+    Each node is placed at `replicas` points on a ring and a key belongs to
+    the first point after its hash. Removing a node only moves that node's
+    keys, spread over the others, and adding it back returns the same keys.
+    """
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._nodes = set()
+        self._lock = threading.Lock()
+        self._points = ((), ())
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return sorted(self._nodes)
+
+    def add(self, node):
+        with self._lock:
+            self._nodes.add(node)
+            self._rebuild()
+
+    def remove(self, node):
+        with self._lock:
+            self._nodes.discard(node)
+            self._rebuild()
+
+    def _rebuild(self):
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in self._nodes
+            for replica in range(self.replicas)
+        )
+        # Swapped in whole, so lookups never need the lock
+        self._points = (
+            tuple(point for point, _ in points),
+            tuple(node for _, node in points),
+        )
+
+    def node_for(self, key):
+        hashes, nodes = self._points
+        if not nodes:
+            return None
+        return nodes[bisect.bisect(hashes, _hash(key)) % len(nodes)]
+
+
+def session_key(cookie_header, cookie_name="session"):
+    """Session id from a request's Cookie header, or None
+
+    With SESSION_USE_SIGNER the cookie is `<sid>.<signature>`. The signature
+    isn't checked: a forged cookie can only choose which worker serves it, and
+    the worker itself rejects it.
+    """
+    if not cookie_header:
+        return None
+    try:
+        morsel = SimpleCookie(cookie_header).get(cookie_name)
+    except CookieError:
+        return None
+    if morsel is None or not morsel.value:
+        return None
+    return morsel.value.rsplit(".", 1)[0]
+
+
+def _run_worker(serve, config, sock, slot):
+    # Turn SIGTERM into a normal exit so atexit handlers (the event log) run
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        serve(config, sock, slot)
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor:
+    """Run worker processes behind one port and route players to them
+
+    Each worker is a separate process serving the app on its own local
+    socket. The supervisor accepts every request and forwards it to the
+    worker that owns the request's session id on a hash ring, so a player's
+    turns keep landing where their speculated replies, rate limits and other
+    in-process state live. Requests without a session cookie go round-robin.
+
+    A worker that exits is taken off the ring straight away and its players
+    move to the others; it is restarted, and once its `/ready` returns 200 it
+    rejoins the ring and gets the same players back. `serve(config, sock,
+    slot)` runs in each worker and must be a module-level function, since
+    workers are started with the spawn method rather than forked from this
+    threaded process.
+    """
+
+    def __init__(
+        self,
+        serve,
+        config,
+        workers=2,
+        host="127.0.0.1",
+        port=5006,
+        cookie_name="session",
+        replicas=64,
+        ready_timeout=120.0,
+        upstream_timeout=120.0,
+        restart_delay=1.0,
+        max_body=1024 * 1024,
+    ):
+        self.serve = serve
+        self.config = config
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.cookie_name = cookie_name
+        self.ready_timeout = ready_timeout
+        self.upstream_timeout = upstream_timeout
+        self.restart_delay = restart_delay
+        self.max_body = max_body
+        self.ring = HashRing(replicas=replicas)
+        self._context = multiprocessing.get_context("spawn")
+        self._sockets = {}
+        self._processes = {}
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._stopping = threading.Event()
+        self._server = None
+        self.requests = {}
+        self.restarts = {}
+        self.last_exit = {}
+        self.routed_by_session = 0
+        self.routed_without_session = 0
+        self.upstream_errors = 0
+        self.rejected_bodies = 0
+
+    @staticmethod
+    def slot_name(index):
+        return f"worker-{index}"
+
+    def address(self, slot):
+        return self._sockets[slot].getsockname()
+
+    def start_worker(self, slot):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.serve, self.config, self._sockets[slot], slot),
+            name=slot,
+        )
+        process.start()
+        self._processes[slot] = process
+        print(f"✓ Started {slot} (pid {process.pid}) on port {self.address(slot)[1]}")
+
+    def route(self, key):
+        """The slot a request goes to; None if no worker is on the ring"""
+        if key is None:
+            nodes = self.ring.nodes
+            slot = nodes[next(self._round_robin) % len(nodes)] if nodes else None
+        else:
+            slot = self.ring.node_for(key)
+        with self._lock:
+            if key is None:
+                self.routed_without_session += 1
+            else:
+                self.routed_by_session += 1
+            if slot is not None:
+                self.requests[slot] = self.requests.get(slot, 0) + 1
+        return slot
+
+    def upstream_failed(self, slot, error):
+        with self._lock:
+            self.upstream_errors += 1
+        print(f"Warning: Could not reach {slot}: {error}")
+
+    def _monitor(self):
+        while not self._stopping.wait(0.5):
+            for slot, process in list(self._processes.items()):
+                if process.is_alive() or self._stopping.is_set():
+                    continue
+                self.ring.remove(slot)
+                self.last_exit[slot] = process.exitcode
+                print(
+                    f"Warning: {slot} exited with code {process.exitcode}; its players move to {len(self.ring.nodes)} other workers"
+                )
+                time.sleep(self.restart_delay)
+                if self._stopping.is_set():
+                    return
+                self.restarts[slot] = self.restarts.get(slot, 0) + 1
+                self.start_worker(slot)
+                threading.Thread(
+                    target=self._rejoin,
+                    args=(slot,),
+                    name=f"rejoin-{slot}",
+                    daemon=True,
+                ).start()
+
+    def _rejoin(self, slot):
+        """Put a restarted worker back on the ring once it has warmed up"""
+        deadline = time.monotonic() + self.ready_timeout
+        process = self._processes[slot]
+        while time.monotonic() < deadline and process.is_alive():
+            if self._stopping.is_set():
+                return
+            try:
+                conn = http.client.HTTPConnection(*self.address(slot), timeout=5)
+                conn.request("GET", "/ready")
+                status = conn.getresponse().status
+                conn.close()
+            except OSError:
+                status = None
+            if status == 200:
+                break
+            time.sleep(0.5)
+        if process.is_alive() and not self._stopping.is_set():
+            self.ring.add(slot)
+            print(f"✓ {slot} rejoined the ring")
+
+    def stats(self):
+        return {
+            "ring": self.ring.nodes,
+            "routed_by_session": self.routed_by_session,
+            "routed_without_session": self.routed_without_session,
+            "upstream_errors": self.upstream_errors,
+            "rejected_bodies": self.rejected_bodies,
+            "workers": {
+                slot: {
+                    "pid": process.pid,
+                    "alive": process.is_alive(),
+                    "port": self.address(slot)[1],
+                    "requests": self.requests.get(slot, 0),
+                    "restarts": self.restarts.get(slot, 0),
+                    "last_exit": self.last_exit.get(slot),
+                }
+                for slot, process in sorted(self._processes.items())
+            },
+        }
+
+    def run(self):
+        """Start the workers and proxy requests to them until interrupted"""
+        for index in range(self.workers):
+            slot = self.slot_name(index)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("127.0.0.1", 0))
+            # The supervisor owns the listening sockets, so a restarted worker
+            # keeps its address
+            sock.listen(128)
+            self._sockets[slot] = sock
+            self.start_worker(slot)
+            self.ring.add(slot)
+
+        # Stop cleanly on SIGTERM as well as Ctrl-C
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        self._server = ThreadingHTTPServer((self.host, self.port), _ProxyHandler)
+        self._server.daemon_threads = True
+        self._server.supervisor = self
+        threading.Thread(target=self._monitor, name="supervisor", daemon=True).start()
+        print(
+            f"✓ Routing sessions across {self.workers} workers on http://{self.host}:{self.port}"
+        )
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopping.set()
+        if self._server is not None:
+            self._server.server_close()
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(10)
+        for sock in self._sockets.values():
+            sock.close()
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.proxy()
+
+    do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_GET
+
+    def log_message(self, format, *args):
+        # Workers log each request themselves
+        pass
+
+    def send_json(self, status, data, headers=()):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def reject(self, status, message):
+        """Answer an unreadable request and close, since its body can't be skipped"""
+        supervisor = self.server.supervisor
+        with supervisor._lock:
+            supervisor.rejected_bodies += 1
+        self.close_connection = True
+        self.send_json(status, {"message": message}, [("Connection", "close")])
+
+    def read_body(self):
+        """The request body, or False once the request has been rejected
+
+        Bodies are read by Content-Length only. Chunked uploads aren't
+        de-chunked: the workers' clients never send them, and forwarding one
+        as empty would leave its bytes to be read as the next request.
+        """
+        if "Transfer-Encoding" in self.headers:
+            self.reject(411, "Send the request with a Content-Length.")
+            return False
+        lengths = set(self.headers.get_all("Content-Length", []))
+        if not lengths:
+            return None
+        length = lengths.pop().strip()
+        if lengths or not length.isdigit():
+            self.reject(400, "Invalid Content-Length.")
+            return False
+        length = int(length)
+        if length > self.server.supervisor.max_body:
+            self.reject(413, "Request body too large.")
+            return False
+        return self.rfile.read(length) if length else None
+
+    def proxy(self):
+        supervisor = self.server.supervisor
+        if self.path == "/api/supervisor":
+            self.send_json(200, supervisor.stats())
+            return
+
+        body = self.read_body()
+        if body is False:
+            return
+        slot = supervisor.route(
+            session_key(self.headers.get("Cookie"), supervisor.cookie_name)
+        )
+        if slot is None:
+            self.send_json(
+                503,
+                {
+                    "message": "The storyteller is restarting. Please try again in a moment.",
+                    "busy": True,
+                    "retry_after": 1,
+                },
+                [("Retry-After", "1")],
+            )
+            return
+
+        conn = http.client.HTTPConnection(
+            *supervisor.address(slot), timeout=supervisor.upstream_timeout
+        )
+        try:
+            conn.putrequest(
+                self.command, self.path, skip_host=True, skip_accept_encoding=True
+            )
+            for name, value in self.headers.items():
+                if name.lower() not in HOP_BY_HOP | {"x-forwarded-for"}:
+                    conn.putheader(name, value)
+            # Append the client's address to any proxies in front of this one
+            forwarded = self.headers.get_all("X-Forwarded-For", [])
+            conn.putheader(
+                "X-Forwarded-For", ", ".join(forwarded + [self.client_address[0]])
+            )
+            conn.endheaders(body)
+            upstream = conn.getresponse()
+        except OSError as e:
+            conn.close()
+            supervisor.upstream_failed(slot, e)
+            self.send_json(
+                502,
+                {
+                    "message": "The storyteller lost their place. Please try again.",
+                    "busy": True,
+                    "retry_after": 1,
+                },
+                [("Retry-After", "1")],
+            )
+            return
+
+        try:
+            self.relay(upstream, slot)
+        except OSError:
+            # The player closed the connection
+            self.close_connection = True
+        finally:
+            conn.close()
+
+    def relay(self, upstream, slot):
+        self.send_response_only(upstream.status, upstream.reason)
+        for name, value in upstream.getheaders():
+            if name.lower() not in HOP_BY_HOP:
+                self.send_header(name, value)
+        self.send_header("X-Worker", slot)
+        has_body = (
+            self.command != "HEAD"
+            and upstream.status >= 200
+            and upstream.status not in (204, 304)
+        )
+        # Bodies without a length (streamed responses) are re-chunked
+        chunked = has_body and upstream.getheader("Content-Length") is None
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if not has_body:
+            return
+        while True:
+            data = upstream.read1(65536)
+            if not data:
+                break
+            if chunked:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            else:
+                self.wfile.write(data)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
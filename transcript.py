@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import secrets
+import threading
+import zlib
+from contextlib import contextmanager
+
+from cachelib import FileSystemCache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Players hash onto this many lock files, so their number stays bounded
+LOCK_STRIPES = 256
+
+
+class TranscriptStore:
+    """Everything a player has read in their current story, in pages
+
+    The web client only keeps the turns near the screen and loads older ones
+    from here as the player scrolls back, so sessions of any length cost the
+    page the same. Entries are numbered from the start of the story and
+    stored `page_size` to a page in their own directory, compressed. Past
+    `max_turns`, the oldest whole pages are deleted.
+
+    Each transcript has a random id, stored in its metadata and in every page.
+    Pages with another id are ignored, so if the metadata is lost (expired or
+    deleted), leftover pages can't reappear in the new transcript. Updates
+    hold a lock file named by a hash of the player id, in
+    `<directory>.locks`, so worker processes sharing the directory don't
+    overwrite a player's pages and other players rarely wait.
+    """
+
+    def __init__(self, directory, page_size=20, max_turns=500, timeout=0, threshold=0):
+        self.directory = directory
+        self.page_size = page_size
+        self.max_turns = max_turns
+        self.timeout = timeout
+        self.threshold = threshold
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    @property
+    def enabled(self):
+        return self.max_turns > 0
+
+    @property
+    def cache(self):
+        # Created on first use, so tools that never record don't create the directory
+        if self._cache is None:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = FileSystemCache(
+                        self.directory, threshold=self.threshold
+                    )
+        return self._cache
+
+    @contextmanager
+    def _player_lock(self, player):
+        digest = hashlib.sha1(str(player).encode("utf-8")).digest()
+        stripe = int.from_bytes(digest[:4], "big") % LOCK_STRIPES
+        with self._locks[stripe]:
+            if fcntl is None:
+                yield
+                return
+            # Beside the cache directory, whose files are all taken for pages
+            lock_dir = os.path.abspath(self.directory).rstrip(os.sep) + ".locks"
+            os.makedirs(lock_dir, exist_ok=True)
+            with open(os.path.join(lock_dir, f"{stripe:02x}.lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _meta(self, player):
+        meta = self.cache.get(f"transcript:{player}")
+        if not meta or "id" not in meta:
+            # Missing metadata means a new transcript; any pages left are stale
+            return {"id": None, "story_index": None, "first": 0, "count": 0}
+        return meta
+
+    def _page(self, player, meta, page):
+        data = self.cache.get(f"transcript:{player}:{page}")
+        if not data:
+            return []
+        data = json.loads(zlib.decompress(data))
+        return data["entries"] if data.get("id") == meta["id"] else []
+
+    def _set_page(self, player, meta, page, entries):
+        data = json.dumps({"id": meta["id"], "entries": entries})
+        self.cache.set(
+            f"transcript:{player}:{page}",
+            zlib.compress(data.encode("utf-8")),
+            self.timeout,
+        )
+
+    def _pages(self, meta):
+        return range(
+            meta["first"] // self.page_size, -(-meta["count"] // self.page_size)
+        )
+
+    def reset(self, player):
+        meta = self._meta(player)
+        for page in self._pages(meta):
+            self.cache.delete(f"transcript:{player}:{page}")
+        self.cache.delete(f"transcript:{player}")
+
+    def _truncate(self, player, meta, index):
+        """Drop the entries from `index` on"""
+        pages = self._pages(meta)
+        meta["count"] = index
+        for page in pages:
+            if page * self.page_size >= index:
+                self.cache.delete(f"transcript:{player}:{page}")
+            elif (page + 1) * self.page_size > index:
+                entries = self._page(player, meta, page)
+                self._set_page(
+                    player, meta, page, [e for e in entries if e["index"] < index]
+                )
+
+    def append(
+        self, player, story_index, scene, text, user=None, restart=False, at=None
+    ):
+        """Add an entry; returns (transcript id, entry index)
+
+        `restart` or a different story starts a new transcript. `at` is a
+        (transcript id, index) position from earlier, such as a checkpoint's:
+        the entries from there on are replaced by this one, or a new
+        transcript is started if that position is gone.
+        """
+        with self._player_lock(player):
+            meta = self._meta(player)
+            if at is not None:
+                at_id, at_index = at
+                if meta["id"] == at_id and meta["first"] <= at_index <= meta["count"]:
+                    self._truncate(player, meta, at_index)
+                else:
+                    restart = True
+            if restart or meta["id"] is None or meta["story_index"] != story_index:
+                self.reset(player)
+                meta = {
+                    "id": secrets.token_hex(8),
+                    "story_index": story_index,
+                    "first": 0,
+                    "count": 0,
+                }
+            return meta["id"], self._append(player, meta, scene, text, user)
+
+    def _append(self, player, meta, scene, text, user):
+        index = meta["count"]
+        page = index // self.page_size
+        entries = self._page(player, meta, page)
+        entries.append({"index": index, "scene": scene, "user": user, "text": text})
+        self._set_page(player, meta, page, entries)
+        meta["count"] = index + 1
+        # Drop the oldest page once all of it is past the cap
+        while True:
+            page_end = (meta["first"] // self.page_size + 1) * self.page_size
+            if page_end > meta["count"] - self.max_turns:
+                break
+            self.cache.delete(f"transcript:{player}:{page_end // self.page_size - 1}")
+            meta["first"] = page_end
+        self.cache.set(f"transcript:{player}", meta, self.timeout)
+        return index
+
+    def read(self, player, before=None, limit=20):
+        """Up to `limit` entries ending just before `before` (default: the end)"""
+        meta = self._meta(player)
+        end = meta["count"] if before is None else min(before, meta["count"])
+        start = max(meta["first"], end - limit)
+        entries = []
+        if start < end:
+            for page in range(start // self.page_size, (end - 1) // self.page_size + 1):
+                entries.extend(
+                    entry
+                    for entry in self._page(player, meta, page)
+                    if start <= entry["index"] < end
+                )
+        return {"first": meta["first"], "count": meta["count"], "entries": entries}
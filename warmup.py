@@ -0,0 +1,50 @@
+import os
+import threading
+import time
+
+
+class Warmup:
+    """Run start-up steps in the background and report when they are done
+
+    Steps are (name, function) pairs run in order. A failing step is logged and
+    recorded but doesn't stop the others: a worker that couldn't pre-open a
+    connection is still able to serve players, just more slowly at first.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.results = {}
+        self._done = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._done.is_set() and self._pid == os.getpid()
+
+    def start(self):
+        """Start warm-up in this process (a forked worker gets its own run)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._done = threading.Event()
+            self.results = {}
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def run(self):
+        started = time.monotonic()
+        for name, step in self.steps:
+            step_started = time.monotonic()
+            try:
+                detail = step()
+                self.results[name] = {"ok": True, "detail": detail}
+            except Exception as e:
+                print(f"Warm-up step '{name}' failed: {e}")
+                self.results[name] = {"ok": False, "detail": str(e)}
+            self.results[name]["seconds"] = round(time.monotonic() - step_started, 3)
+        print(f"✓ Warm-up finished in {time.monotonic() - started:.2f}s")
+        self._done.set()
+
+    def status(self):
+        return {"ready": self.ready, "steps": dict(self.results)}
@@ -0,0 +1,10 @@
+"""Production entry point
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Settings come from the environment, .env, or the file named by CLIFFHANGER_CONFIG.
+"""
+
+from app import create_app
+
+app = create_app()